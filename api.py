@@ -1,156 +1,339 @@
-from flask import Flask, jsonify, request, render_template, flash
-import joblib
-import pandas as pd
-import numpy as np
+from flask import Flask, jsonify, request, render_template, flash, g
 from forms import PredictionForm, UkPredictionForm
+from registry import BASE_DIR, ModelRegistry, import_xgboost, load_booster, load_joblib, load_pickle
+from table import PredictionTable
+from batching import BatchTimeoutError, MicroBatcher, QueueFullError
+from features import NIGERIA_SCHEMA, UK_SCHEMA, SCHEMAS, MissingFieldError, InvalidFieldError, parse_listings
+from metrics import Metrics
+from audit import AuditLog
 import logging
 import os
-import pickle
+import time
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
 
 
 load_dotenv()
 
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
+# Setup logging, debug logging on every request is expensive so it is opt-in
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
+# request counters are always kept, stage timings only for a sampled fraction
+metrics = Metrics(sample_rate=float(os.getenv('METRICS_SAMPLE_RATE', 1)))
+
+# every prediction is recorded for drift analysis and replay when AUDIT_LOG is set
+audit_log = None
+if os.getenv('AUDIT_LOG'):
+    audit_log = AuditLog(
+        os.getenv('AUDIT_LOG'),
+        max_queue=int(os.getenv('AUDIT_MAX_QUEUE', 10000)),
+        max_queue_bytes=int(os.getenv('AUDIT_MAX_QUEUE_BYTES', 64 * 1024 * 1024)),
+        batch_size=int(os.getenv('AUDIT_BATCH_SIZE', 256)),
+        flush_interval=float(os.getenv('AUDIT_FLUSH_INTERVAL', 1)),
+        max_bytes=int(os.getenv('AUDIT_MAX_BYTES', 100 * 1024 * 1024)),
+        max_age=float(os.getenv('AUDIT_MAX_AGE', 0)),
+        compress=os.getenv('AUDIT_COMPRESS', '1') == '1',
+        backups=int(os.getenv('AUDIT_BACKUPS', 10))
+    )
+
+
+# loading every model once at startup, artifacts are re-checked for changes
+registry = ModelRegistry(check_interval=float(os.getenv('MODEL_CHECK_INTERVAL', 5)))
+# native boosters (see export_models.py) start faster than the pickled sklearn models
+MODEL_FORMAT = os.getenv('MODEL_FORMAT', 'auto')
+if MODEL_FORMAT == 'auto':
+    MODEL_FORMAT = 'native' if os.path.exists(os.path.join(BASE_DIR, 'models', 'nigeria.ubj')) else 'pickle'
+if MODEL_FORMAT == 'native':
+    import_xgboost(lean=True)
+    registry.register('nigeria', os.path.join('models', 'nigeria.ubj'), load_booster)
+    registry.register('uk', os.path.join('models', 'uk.ubj'), load_booster)
+else:
+    registry.register('nigeria', 'nigerira.plk', load_joblib)
+    registry.register('uk', 'model_uk.plk', load_pickle)
+# the fast path passes bare arrays, so refuse models trained on other columns
+registry.add_listener(lambda entry: SCHEMAS[entry.name].check(entry.booster))
+
+# capping prediction threads, serve.py sets this so workers x threads fits the cores
+if os.getenv('XGB_NTHREAD'):
+    registry.add_listener(lambda entry: entry.booster.set_param({'nthread': int(os.getenv('XGB_NTHREAD'))}))
+
+
+def build_table(entry):
+    """ scores the whole feature grid of a freshly loaded model """
+
+    entry.table = PredictionTable(SCHEMAS[entry.name], entry.booster,
+                                  cache_size=int(os.getenv('PREDICTION_CACHE_SIZE', 4096)))
+
+
+# answering requests from a precomputed table, rebuilt whenever a model changes
+if os.getenv('PREDICTION_TABLE', '0') == '1':
+    registry.add_listener(build_table)
+
+registry.load_all()
+
+# largest number of listings accepted by the batch endpoints
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', 10000))
+# bodies larger than this are refused before they are read, a listing is well under 512 bytes
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', BATCH_MAX_ROWS * 512))
+
+
+def predict_matrix(name, matrix):
+    """ predicts an encoded matrix with the current model """
+
+    entry = registry.get(name)
+    if entry.table is None:
+        return entry.booster.inplace_predict(matrix)
+    return entry.table.predict_batch(matrix)
+
+
+# coalescing concurrent single predictions into batched predict calls
+batchers = {}
+if os.getenv('MICRO_BATCHING', '0') == '1':
+    for name in registry.names():
+        batchers[name] = MicroBatcher(
+            name, lambda matrix, name=name: predict_matrix(name, matrix),
+            max_batch_size=int(os.getenv('MICRO_BATCH_MAX_SIZE', 64)),
+            max_wait=float(os.getenv('MICRO_BATCH_WAIT_MS', 2)) / 1000,
+            max_queue=int(os.getenv('MICRO_BATCH_MAX_QUEUE', 1024)),
+            timeout=float(os.getenv('MICRO_BATCH_TIMEOUT', 5)) or None
+        )
+
+
+def predict_listing(name, data, timer):
+    """ encodes one listing and predicts it with the current model """
+
+    entry = registry.get(name)
+    timer.mark('model')
+    row = SCHEMAS[name].encode(data)
+    timer.mark('validate')
+
+    if entry.table is not None:
+        prediction = entry.table.predict(row[0])
+    elif name in batchers:
+        prediction = batchers[name].submit(row[0])
+    else:
+        prediction = float(entry.booster.inplace_predict(row)[0])
+    timer.mark('predict')
+
+    if audit_log is not None:
+        g.audit = {'model': name, 'version': entry.version, 'prediction': prediction,
+                   'input': data.to_dict() if hasattr(data, 'to_dict') else data}
+    return prediction
+
+
+def stage_timer(model):
+    """ stage timer for the current request """
+
+    return metrics.timer(request.endpoint, model, g.get('sampled', False))
+
+
+@app.before_request
+def start_request():
+    g.sampled = metrics.sampled()
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    route = request.endpoint or 'unknown'
+    status = response.status_code
+    metrics.inc('requests_total', (('route', route), ('status', str(status))))
+    # views mark failures in g.outcome (the form views answer 200 even when they
+    # fail), responses no view marked such as 404s fall back to the status code
+    outcome = g.get('outcome')
+    if outcome is None and status >= 400:
+        outcome = 'validation' if status == 422 else 'error'
+    if outcome == 'validation':
+        metrics.inc('validation_failures_total', (('route', route),))
+    elif outcome == 'error':
+        metrics.inc('errors_total', (('route', route),))
+    if g.get('sampled'):
+        metrics.observe('request_seconds', (('route', route),), time.perf_counter() - g.start)
+    if g.get('audit') is not None:
+        record_audit(g.audit, status)
+    return response
+
+
+def record_audit(audit, status):
+    """ hands one prediction to the audit log, in the bench.py replay format """
+
+    record = {
+        'ts': datetime.now(timezone.utc).isoformat(),
+        'method': request.method,
+        'path': request.path,
+    }
+    if 'input' in audit:
+        data = audit.pop('input')
+        if request.form:
+            record['form'] = {k: v for k, v in data.items() if k != 'csrf_token'}
+        else:
+            record['json'] = data
+    record.update(audit, status=status, latency_ms=round((time.perf_counter() - g.start) * 1000, 3))
+    audit_log.record(record, size=request.content_length or 0)
+
+
 @app.route('/api/v1/nigeria/predict', methods=['POST'], strict_slashes=False)
 def predict_nigeria():
     """ view that handles prediction of house rent in Nigeria """
 
-    if request.method == 'POST':
-        # handling json data from client side
-        if request.get_json():
-            # receiving json inputs
-            serviced = request.json.get('serviced', None)
-            newly_built = request.json.get('newly_built', None)
-            furnished = request.json.get('furnished', None)
-            bedrooms = request.json.get('bedrooms', None)
-            bathrooms = request.json.get('bathrooms', None)
-            toilets = request.json.get('toilets', None)
-
-            # validating values
-            if serviced is None or newly_built is None or furnished is \
-                None or bedrooms is None or bathrooms is None or toilets is None:
-                return jsonify({
-                    'error': 'all input fields must be entered'
-                }), 422
+    timer = stage_timer('nigeria')
+
+    # handling json data from client side
+    data = request.get_json()
+    timer.mark('parse')
+    if not data:
+        g.outcome = 'validation'
+        return jsonify({'error': 'all input fields must be entered'}), 422
+
+    try:
+        prediction = predict_listing('nigeria', data, timer)
+    except MissingFieldError:
+        g.outcome = 'validation'
+        return jsonify({
+            'error': 'all input fields must be entered'
+        }), 422
+    except InvalidFieldError as e:
+        g.outcome = 'validation'
+        return jsonify({
+            'error': {
+                'fields': [e.key],
+                'message': 'fields must be numbers'
+            }
+        }), 422
+    except (QueueFullError, BatchTimeoutError) as e:
+        g.outcome = 'error'
+        return jsonify({'error': f'{e}, please try again'}), 503
+    except Exception as e:
+        g.outcome = 'error'
+        return jsonify({
+            'error': f'an exception occurred, please try again: {e}'
+        }), 400
+
+    return jsonify(
+        {'success': {
+            'country': 'Nigeria',
+            'currency': 'Naira',
+            'duration': 'yearly',
+            'rent': int(prediction)
+            }
+        }), 200
 
-            try:
-                bedrooms = int(bedrooms)
-                bathrooms = int(bathrooms)
-                toilets = int(toilets)
-            except ValueError:
-                return jsonify({
-                    'error': {
-                        'fields': ['bedrooms', 'bathrooms', 'toilets'],
-                        'message': 'fields must be numbers'
-                    }
-                }), 422
-
-            # encoding inputs
-            if serviced.lower() == 'yes':
-                serviced = 1
-            else:
-                serviced = 0
-            
-            if newly_built.lower() == 'yes':
-                newly_built = 1
-            else:
-                newly_built = 0
-            if furnished.lower() == 'yes':
-                furnished = 1
-            else:
-                furnished = 0
-
-            try:
-                df = pd.DataFrame({
-                    'Serviced': [serviced],
-                    'Newly Built': [newly_built],
-                    'Furnished': [furnished],
-                    'Bedrooms': [bedrooms],
-                    'Bathrooms': [bathrooms],
-                    'Toilets': [toilets]
-                })
-
-                 # loading the model
-                logging.debug("Loading model")
-                loaded_model = joblib.load('nigerira.plk')
-                logging.debug("Model loaded successfully")
-                print(type(loaded_model))
-                
-                prediction = loaded_model.predict(df)[0]  # Get the first element from the prediction array
-                logging.debug(f"Prediction made: {prediction}")
-
-                # formatting the prediction value to be comma seperated
-                prediction = f"{prediction:,}"
-
-                
-                return jsonify(
-                    {'success': {
-                        'country': 'Nigeria',
-                        'currency': 'Naira',
-                        'duration': 'yearly',
-                        'rent': int(prediction)
-                        }
-                    }), 200
-
-            except Exception as e:
-                return jsonify({
-                    'error': f'an exception occurred, please try again: {e}'
-                }), 400
 
 @app.route('/api/vi/uk/predict', methods=['POST'], strict_slashes=False)
 def predict_uk():
     """ api view for handling logic for uk rent prediction """
 
-    if request.method == 'POST':
-        if request.get_json():
-
-            # receiving input
-            room = int(request.json.get('bedrooms'))
-            if not room:
-                return jsonify({'validation error': 'room field cannot be blank'}), 422
-            
-            try:
-                df = pd.DataFrame({'Number of Rooms': [room]})
-
-                # getting the path of the model
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                file_path = os.path.join(script_dir, 'model_uk.plk')
-                with open(file_path, 'rb') as m:
-                    loaded_model = pickle.load(m)
-                #loaded_model = joblib.load('model_uk.plk')
-                prediction = loaded_model.predict(df)[0]
-
-                # formatting the prediction value to be comma seperated
-                prediction = f"{prediction:,}"
-                
-
-                return jsonify(
-                    {
-                      'success': {
-                          'country': 'England',
-                          'currency': 'Pounds',
-                          'duration': 'monthly',
-                          'rent': int(prediction)
-                      }
-                    
-                    }
-                ), 200
-            
-            except Exception as e:
-                return jsonify(
-                    {
-                        'error': f'an exception occured, try again: str{e}'
-                    }
-                ), 400
-            
+    timer = stage_timer('uk')
+
+    data = request.get_json()
+    timer.mark('parse')
+    if not data:
+        g.outcome = 'validation'
+        return jsonify({'validation error': 'room field cannot be blank'}), 422
+
+    try:
+        prediction = predict_listing('uk', data, timer)
+    except MissingFieldError:
+        g.outcome = 'validation'
+        return jsonify({'validation error': 'room field cannot be blank'}), 422
+    except InvalidFieldError as e:
+        g.outcome = 'validation'
+        return jsonify({'validation error': str(e)}), 422
+    except (QueueFullError, BatchTimeoutError) as e:
+        g.outcome = 'error'
+        return jsonify({'error': f'{e}, please try again'}), 503
+    except Exception as e:
+        g.outcome = 'error'
+        return jsonify(
+            {
+                'error': f'an exception occured, try again: {e}'
+            }
+        ), 400
+
+    return jsonify(
+        {
+          'success': {
+              'country': 'England',
+              'currency': 'Pounds',
+              'duration': 'monthly',
+              'rent': int(prediction)
+          }
+        }
+    ), 200
+
+
+def batch_predict(schema, currency_info):
+    """ scores a json array or ndjson body of listings with one predict call """
+
+    timer = stage_timer(schema.name)
+    try:
+        listings, rejected = parse_listings(request.get_data(), request.content_type)
+    except RequestEntityTooLarge:
+        g.outcome = 'validation'
+        return jsonify({'error': f'batch body cannot be larger than {app.config["MAX_CONTENT_LENGTH"]} bytes'}), 413
+    except ValueError as e:
+        g.outcome = 'validation'
+        return jsonify({'error': f'invalid batch body: {e}'}), 400
+    timer.mark('parse')
+
+    if len(listings) > BATCH_MAX_ROWS:
+        g.outcome = 'validation'
+        return jsonify({'error': f'batch cannot contain more than {BATCH_MAX_ROWS} listings'}), 413
+
+    matrix, indices, errors = schema.encode_batch(listings, rejected)
+    timer.mark('validate')
+    if not indices:
+        g.outcome = 'validation'
+        return jsonify({'error': {'rows': errors, 'message': 'no valid listings in batch'}}), 422
+
+    try:
+        predictions = predict_matrix(schema.name, matrix)
+    except Exception as e:
+        g.outcome = 'error'
+        return jsonify({'error': f'an exception occurred, please try again: {e}'}), 400
+    timer.mark('predict')
+
+    if audit_log is not None:
+        # the raw body rather than the parsed listings: smaller to hold while
+        # queued, and ndjson batches replay exactly as they were sent
+        g.audit = {'model': schema.name, 'version': registry.get(schema.name).version,
+                   'body': request.get_data(as_text=True), 'content_type': request.content_type,
+                   'indices': indices, 'predictions': predictions.tolist()}
+
+    return jsonify({
+        'success': dict(currency_info, predictions=[
+            {'index': i, 'rent': int(rent)} for i, rent in zip(indices, predictions.tolist())
+        ]),
+        'errors': errors
+    }), 200
+
+
+@app.route('/api/v1/nigeria/predict/batch', methods=['POST'], strict_slashes=False)
+def predict_nigeria_batch():
+    """ batch prediction of house rent in Nigeria """
+
+    return batch_predict(NIGERIA_SCHEMA, {
+        'country': 'Nigeria',
+        'currency': 'Naira',
+        'duration': 'yearly'
+    })
+
+
+@app.route('/api/vi/uk/predict/batch', methods=['POST'], strict_slashes=False)
+def predict_uk_batch():
+    """ batch prediction of house rent in the UK """
+
+    return batch_predict(UK_SCHEMA, {
+        'country': 'England',
+        'currency': 'Pounds',
+        'duration': 'monthly'
+    })
 
 
 # views for handling form data from the frontend
@@ -160,105 +343,123 @@ def nigeria_form_predict():
     """ method for handling prediction from form data """
 
     form = PredictionForm()
+    timer = stage_timer('nigeria')
 
-    # handling form data from client side
-    if request.method == 'POST':
-        if form.validate_on_submit():
-
-            # collecting validated form data
-            serviced = request.form.get('serviced', None)
-            newly_built = request.form.get('newly_built', None) 
-            furnished = request.form.get('furnished', None) 
-            bedrooms = request.form.get('bedrooms', None) 
-            bathrooms = request.form.get('bathrooms', None)
-            toilets = request.form.get('toilets', None)
-
-           
-            # encoding inputs
-            if serviced.lower() == 'yes':
-                serviced = 1
-            else:
-                serviced = 0
-            
-            if newly_built.lower() == 'yes':
-                newly_built = 1
-            else:
-                newly_built = 0
-            if furnished.lower() == 'yes':
-                furnished = 1
-            else:
-                furnished = 0
-
-        logging.debug('creating a dataframe') #############
-        
+    # handling validated form data from client side
+    if request.method == 'POST' and form.validate_on_submit():
+        timer.mark('parse')
         try:
-            df = pd.DataFrame({
-                    'Serviced': [serviced],
-                    'Newly Built': [newly_built],
-                    'Furnished': [furnished],
-                    'Bedrooms': [int(bedrooms)],
-                    'Bathrooms': [int(bathrooms)],
-                    'Toilets': [int(toilets)]
-                })
-
-           
+            prediction = predict_listing('nigeria', request.form, timer)
 
-            
-            logging.debug('dataframe created') ############
-
-            loaded_model = joblib.load('nigerira.plk')
-
-            logging.debug('model loaded successfully') ############
-
-            prediction = int(loaded_model.predict(df)[0])
             # formatting the prediction value to be comma seperated
-            prediction = f"{prediction:,}"
-
-            logging.debug('model predicted successfully') ############
+            prediction = f"{int(prediction):,}"
             currency = 'Naira'
             country = 'Nigeria'
 
             flash("prediction was successful")
-            logging.debug(f'prediction is {prediction}')
+            page = render_template('success.html', prediction=prediction, country=country, currency=currency)
+            timer.mark('render')
+            return page
 
-            
-            return render_template('success.html', prediction=prediction, country=country, currency=currency)
-        
-        except Exception:
+        except Exception as e:
+            g.outcome = 'validation' if isinstance(e, (MissingFieldError, InvalidFieldError)) else 'error'
             flash(f'an exception occured, please try again')
+    elif request.method == 'POST':
+        g.outcome = 'validation'
     return render_template('Nigeria_predict.html', form=form)
 
 
 @app.route('/form/v1/england/predict', methods=['POST', 'GET'], strict_slashes=False)
 def england_form_predict():
     form = UkPredictionForm()
+    timer = stage_timer('uk')
     if request.method == 'POST':
 
         if form.validate_on_submit():
-            bedroom = request.form.get('bedrooms')
+            timer.mark('parse')
             try:
-                df = pd.DataFrame({'Number of Rooms': [int(bedroom)]})
-                # getting the path of the model
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                file_path = os.path.join(script_dir, 'model_uk.plk')
-                with open(file_path, 'rb') as m:
-                    loaded_model = pickle.load(m)
-                #loaded_model = joblib.load('model_uk.plk')
-                prediction = int(loaded_model.predict(df)[0])
+                prediction = predict_listing('uk', request.form, timer)
 
                 # formatting the prediction value to be comma seperated
-                prediction = f"{prediction:,}"
-
-                
-               
+                prediction = f"{int(prediction):,}"
 
                 flash("prediction was successful")
-                return render_template('success.html', prediction=prediction, currency='British Pounds', country='England')
+                page = render_template('success.html', prediction=prediction, currency='British Pounds', country='England')
+                timer.mark('render')
+                return page
             except Exception as  e:
+                g.outcome = 'validation' if isinstance(e, (MissingFieldError, InvalidFieldError)) else 'error'
                 flash(f'an exception occured, please try again: {e}')
+        else:
+            g.outcome = 'validation'
 
     return render_template('Uk_predict.html', form=form)
-    
+
+
+@app.route('/api/v1/models', methods=['GET'], strict_slashes=False)
+def models():
+    """ versions and load times of the models currently being served """
+
+    info = registry.info()
+    for name, entry_info in info.items():
+        table = registry.get(name).table
+        entry_info['table'] = None if table is None else table.stats()
+        entry_info['batcher'] = batchers[name].stats() if name in batchers else None
+    return jsonify({'models': info}), 200
+
+
+def collect_metrics():
+    """ model, table, batcher and audit log samples computed at scrape time """
+
+    entries = [registry.get(name) for name in registry.names()]
+    extra = [
+        ('model_info', 'gauge', 'version of the model being served',
+         [((('model', e.name), ('version', e.version)), 1) for e in entries]),
+        ('model_loaded_timestamp_seconds', 'gauge', 'when the model being served was loaded',
+         [((('model', e.name),), e.loaded_at.timestamp()) for e in entries]),
+    ]
+    tables = [(e.name, e.table.stats()) for e in entries if e.table is not None]
+    if tables:
+        extra.append(('table_lookups_total', 'counter', 'prediction table lookups by result',
+                      [((('model', name), ('result', result)), stats[key]) for name, stats in tables
+                       for result, key in (('hit', 'hits'), ('cache_hit', 'cache_hits'), ('miss', 'misses'))]))
+    if batchers:
+        stats = [(name, b.stats()) for name, b in batchers.items()]
+        extra.append(('batcher_queue_depth', 'gauge', 'rows waiting in the micro-batching queue',
+                      [((('model', name),), s['queue_depth']) for name, s in stats]))
+        extra.append(('batcher_batches_total', 'counter', 'batched predict calls made',
+                      [((('model', name),), s['batches']) for name, s in stats]))
+        extra.append(('batcher_rows_total', 'counter', 'rows scored through the batcher',
+                      [((('model', name),), s['rows']) for name, s in stats]))
+        extra.append(('batcher_rejected_total', 'counter', 'rows rejected because the queue was full',
+                      [((('model', name),), s['rejected']) for name, s in stats]))
+        extra.append(('batcher_timeouts_total', 'counter', 'rows not predicted within MICRO_BATCH_TIMEOUT',
+                      [((('model', name),), s['timeouts']) for name, s in stats]))
+
+    if audit_log is not None:
+        stats = audit_log.stats()
+        extra.append(('audit_queue_depth', 'gauge', 'audit records waiting to be written',
+                      [((), stats['queue_depth'])]))
+        extra.append(('audit_queue_bytes', 'gauge', 'request body bytes held by queued audit records',
+                      [((), stats['queue_bytes'])]))
+        extra.append(('audit_records_total', 'counter', 'audit records by outcome',
+                      [((('result', result),), stats[result]) for result in ('written', 'dropped', 'write_errors')]))
+        extra.append(('audit_rotations_total', 'counter', 'audit log file rotations',
+                      [((), stats['rotations'])]))
+    return extra
+
+
+# serve.py sets this so every worker's /metrics reports the totals of all workers
+if os.getenv('METRICS_DIR'):
+    metrics.share(os.getenv('METRICS_DIR'), collect_metrics,
+                  interval=float(os.getenv('METRICS_SHARE_INTERVAL', 1)))
+
+
+@app.route('/metrics', methods=['GET'], strict_slashes=False)
+def metrics_view():
+    """ request, error and stage timing metrics in prometheus text format """
+
+    return metrics.render(collect_metrics()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 
 @app.route("/success", strict_slashes=False)
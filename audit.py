@@ -0,0 +1,228 @@
+""" append-only audit log of predictions, written off the request path
+
+views hand each record to `AuditLog.record`, which only puts it on a bounded
+in-memory queue; when the queue holds too many records, or too many bytes of
+request bodies, the record is dropped and counted, so a request never waits
+for disk. a background thread serializes records to jsonl in batches, writes
+them through a buffered file and rotates the file by size or age, optionally
+gzipping the rotated file.
+
+every line is a request in the format `bench.py --replay` reads, plus the
+model, version, prediction, status and latency:
+
+    {"ts": "...", "method": "POST", "path": "/api/v1/nigeria/predict", "json": {...},
+     "model": "nigeria", "version": "4f4b945bd312", "prediction": 6663592.0,
+     "status": 200, "latency_ms": 0.61}
+
+batch requests keep their raw body and content type instead of the parsed
+listings, so ndjson batches replay exactly as they were sent:
+
+    {"ts": "...", "method": "POST", "path": "/api/v1/nigeria/predict/batch",
+     "content_type": "application/x-ndjson", "body": "{...}\\n{...}\\n", ...}
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+from background import ProcessThread
+
+
+class AuditLog:
+    """ bounded queue of audit records drained by a writer thread
+
+    `path` may contain `{pid}` so every worker process writes its own file.
+    without it, processes forked from the one that created the log (like
+    serve.py workers) still get their own `<name>.<pid><ext>` file, since
+    workers appending to one file would rotate it under each other
+    """
+
+    def __init__(self, path, max_queue=10000, max_queue_bytes=64 * 1024 * 1024, batch_size=256,
+                 flush_interval=1.0, max_bytes=100 * 1024 * 1024, max_age=0, compress=True, backups=10):
+        self.path_template = path
+        self.max_queue_bytes = max_queue_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.backups = backups
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queue_bytes = 0
+        self._bytes_lock = threading.Lock()
+        self._writer = ProcessThread(self._run, 'audit-log', on_start=self._started)
+        self._owner_pid = os.getpid()
+        self._file = None
+        self._opened_at = 0.0
+
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    @property
+    def path(self):
+        pid = os.getpid()
+        if '{pid}' in self.path_template:
+            return self.path_template.replace('{pid}', str(pid))
+        if pid == self._owner_pid:
+            return self.path_template
+        root, extension = os.path.splitext(self.path_template)
+        return f'{root}.{pid}{extension}'
+
+    def record(self, record, size=0):
+        """ queues one record without blocking, drops it when the queue is full
+
+        `size` approximates the memory the record holds, the request body
+        length, and counts towards `max_queue_bytes`
+        """
+
+        self._writer.ensure_started()
+        with self._bytes_lock:
+            if self.max_queue_bytes and self._queue_bytes + size > self.max_queue_bytes:
+                self.dropped += 1
+                return
+            self._queue_bytes += size
+        try:
+            self._queue.put_nowait((record, size))
+        except queue.Full:
+            self._release(size)
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'queue_bytes': self._queue_bytes,
+            'written': self.written,
+            'dropped': self.dropped,
+            'rotations': self.rotations,
+            'write_errors': self.write_errors,
+        }
+
+    def close(self, timeout=5.0):
+        """ writes whatever is still queued, used at interpreter exit
+
+        records that cannot be written within `timeout` are counted as dropped
+        """
+
+        if not self._writer.running():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+            finished = self._writer.join(timeout)
+        except queue.Full:
+            finished = False
+        if not finished:
+            lost = self._queue.qsize()
+            self.dropped += lost
+            logging.warning(f'audit log closed with {lost} records not written')
+
+    def _release(self, size):
+        with self._bytes_lock:
+            self._queue_bytes -= size
+
+    def _started(self):
+        # a forked worker must not reuse the file object of its parent
+        self._file = None
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self._maybe_rotate()
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            items = [item for item in batch if item is not None]
+            self._release(sum(size for _, size in items))
+            self._write([record for record, _ in items])
+            if stop:
+                self._close_file()
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        lines = []
+        for record in records:
+            try:
+                lines.append(json.dumps(record, default=str))
+            except (TypeError, ValueError):
+                self.write_errors += 1
+        try:
+            self._maybe_rotate()
+            f = self._open()
+            f.write(('\n'.join(lines) + '\n').encode())
+            f.flush()
+            self.written += len(lines)
+        except OSError:
+            self.write_errors += len(lines)
+            logging.exception('writing the audit log failed')
+            self._close_file()
+
+    def _open(self):
+        if self._file is None:
+            path = self.path
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'ab', buffering=1024 * 1024)
+            self._opened_at = time.monotonic()
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _maybe_rotate(self):
+        if self._file is None:
+            return
+        too_big = self.max_bytes and self._file.tell() >= self.max_bytes
+        too_old = self.max_age and time.monotonic() - self._opened_at >= self.max_age
+        if too_big or too_old:
+            self._rotate()
+
+    def _rotate(self):
+        self._close_file()
+        path = self.path
+        rotated = f'{path}.{datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S%f")}'
+        try:
+            os.replace(path, rotated)
+            if self.compress:
+                with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(rotated)
+            self.rotations += 1
+            self._prune()
+        except OSError:
+            logging.exception('rotating the audit log failed')
+
+    def _prune(self):
+        if not self.backups:
+            return
+        rotated = sorted(glob.glob(glob.escape(self.path) + '.*'))
+        for old in rotated[:-self.backups]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
@@ -0,0 +1,44 @@
+""" background threads that are started lazily in every process that uses them """
+
+import os
+import threading
+
+
+class ProcessThread:
+    """ a daemon thread running `target`, started at most once per process
+
+    threads do not survive fork, so a worker forked after the owner was
+    created starts its own thread the first time it calls `ensure_started`.
+    `on_start` runs just before the thread starts, in the new process
+    """
+
+    def __init__(self, target, name, on_start=None):
+        self.target = target
+        self.name = name
+        self.on_start = on_start
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def running(self):
+        """ whether the thread was started in this process """
+
+        return self._thread is not None and self._pid == os.getpid()
+
+    def ensure_started(self):
+        if self.running():
+            return
+        with self._lock:
+            if self.running():
+                return
+            self._pid = os.getpid()
+            if self.on_start is not None:
+                self.on_start()
+            self._thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            self._thread.start()
+
+    def join(self, timeout=None):
+        """ waits for the thread to return, returns False on timeout """
+
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
@@ -0,0 +1,126 @@
+""" micro-batching of concurrent single-row predictions
+
+each model gets one scheduler thread. request threads put their encoded row
+on a bounded queue and wait; the scheduler flushes the queue as one batched
+predict when it holds `max_batch_size` rows or `max_wait` seconds after the
+first row arrived, then hands every caller its own result. a caller waits at
+most `timeout` seconds for its result.
+"""
+
+import queue
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from background import ProcessThread
+
+
+class QueueFullError(RuntimeError):
+    """ raised when the scheduler queue is full, callers should back off """
+
+
+class BatchTimeoutError(RuntimeError):
+    """ raised when a row was not predicted within the timeout, callers should back off """
+
+
+class MicroBatcher:
+    """ coalesces concurrent single-row predictions into batched calls
+
+    `predict` receives a float32 matrix and returns one prediction per row
+    """
+
+    # upper bounds of the batch size histogram
+    BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+    def __init__(self, name, predict, max_batch_size=64, max_wait=0.002, max_queue=1024, timeout=None):
+        self.name = name
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._scheduler = ProcessThread(self._run, f'batcher-{name}')
+
+        self.batches = 0
+        self.rows = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.max_batch_seen = 0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def submit(self, row, timeout=None):
+        """ queues one encoded row and blocks until its prediction is ready
+
+        waits at most `timeout` seconds, the batcher's timeout by default
+        """
+
+        self._scheduler.ensure_started()
+        future = Future()
+        try:
+            # the row buffer is reused by the caller's thread, so queue a copy
+            self._queue.put_nowait((np.array(row, dtype=np.float32), future))
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFullError(f'{self.name} prediction queue is full') from None
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            # the future is left pending, the scheduler still sets its result
+            self.timeouts += 1
+            raise BatchTimeoutError(f'{self.name} prediction timed out after {timeout}s') from None
+
+    def stats(self):
+        """ queue depth and batch size metrics """
+
+        buckets = {str(b): n for b, n in zip(self.BUCKETS, self.histogram)}
+        buckets['+Inf'] = self.histogram[-1]
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'batches': self.batches,
+            'rows': self.rows,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'mean_batch_size': self.rows / self.batches if self.batches else 0,
+            'max_batch_size_seen': self.max_batch_seen,
+            'batch_size_histogram': buckets,
+        }
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        size = len(batch)
+        self.batches += 1
+        self.rows += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        for i, bound in enumerate(self.BUCKETS):
+            if size <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+        try:
+            predictions = self.predict(np.stack([row for row, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), prediction in zip(batch, predictions.tolist()):
+            future.set_result(float(prediction))
@@ -0,0 +1,414 @@
+""" load-test and latency benchmark for the prediction routes
+
+traffic comes from a synthetic generator or is replayed from a jsonl request
+log, one request per line:
+
+    {"method": "POST", "path": "/api/v1/nigeria/predict", "json": {...}}
+    {"method": "POST", "path": "/form/v1/england/predict", "form": {...}}
+    {"method": "POST", "path": "/api/v1/nigeria/predict/batch", "content_type": "application/x-ndjson", "body": "..."}
+
+requests are sent either in-process through the Flask test client or over
+HTTP to a running server, at a configurable concurrency. throughput and
+p50/p95/p99 latency per endpoint are printed and saved as json.
+
+    python bench.py --requests 5000 --concurrency 8 --output before.json
+    python bench.py --target http --replay traffic.jsonl --output after.json --compare before.json
+
+`--startup` instead measures the cold start time and resident memory of a
+worker importing api.py with each model format:
+
+    python bench.py --startup 5 --output startup.json
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+ROUTES = {
+    'nigeria': '/api/v1/nigeria/predict',
+    'uk': '/api/vi/uk/predict',
+    'nigeria_form': '/form/v1/nigeria/predict',
+    'england_form': '/form/v1/england/predict',
+    'nigeria_batch': '/api/v1/nigeria/predict/batch',
+    'uk_batch': '/api/vi/uk/predict/batch',
+}
+
+DEFAULT_ROUTES = ['nigeria', 'uk', 'nigeria_form', 'england_form']
+
+# relative weights of bedroom counts, most traffic asks for 2-4 bedrooms
+BEDROOM_WEIGHTS = {1: 10, 2: 25, 3: 30, 4: 20, 5: 8, 6: 4, 7: 2, 8: 1}
+
+
+def synthetic_listing(rng, yes_no):
+    """ one random Nigeria listing in the json api format """
+
+    bedrooms = rng.choices(list(BEDROOM_WEIGHTS), weights=list(BEDROOM_WEIGHTS.values()))[0]
+    bathrooms = max(1, bedrooms + rng.randint(-1, 1))
+    return {
+        'serviced': yes_no(),
+        'newly_built': yes_no(),
+        'furnished': yes_no(),
+        'bedrooms': bedrooms,
+        'bathrooms': bathrooms,
+        'toilets': bathrooms + rng.randint(0, 1),
+    }
+
+
+def synthetic_requests(count, routes, seed=0, batch_size=50):
+    """ generates `count` requests spread evenly over `routes` """
+
+    rng = random.Random(seed)
+
+    def yes_no():
+        return rng.choice(['Yes', 'No'])
+
+    requests = []
+    for i in range(count):
+        route = routes[i % len(routes)]
+        listing = synthetic_listing(rng, yes_no)
+        if route == 'nigeria':
+            requests.append({'path': ROUTES[route], 'json': listing})
+        elif route == 'uk':
+            requests.append({'path': ROUTES[route], 'json': {'bedrooms': listing['bedrooms']}})
+        elif route == 'nigeria_form':
+            requests.append({'path': ROUTES[route], 'form': listing})
+        elif route == 'england_form':
+            requests.append({'path': ROUTES[route], 'form': {'bedrooms': listing['bedrooms']}})
+        elif route == 'nigeria_batch':
+            requests.append({'path': ROUTES[route],
+                             'json': [synthetic_listing(rng, yes_no) for _ in range(batch_size)]})
+        elif route == 'uk_batch':
+            requests.append({'path': ROUTES[route],
+                             'json': [{'bedrooms': synthetic_listing(rng, yes_no)['bedrooms']}
+                                      for _ in range(batch_size)]})
+    return requests
+
+
+def replay_requests(path, limit=None):
+    """ reads requests from a jsonl log, skipping lines without a path """
+
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if 'path' not in record:
+                continue
+            requests.append(record)
+            if limit and len(requests) >= limit:
+                break
+    return requests
+
+
+class InProcessClient:
+    """ sends requests through the Flask test client, one client per thread """
+
+    def __init__(self):
+        os.environ.setdefault('SECRET_KEY', 'bench')
+        import api
+
+        api.app.config['WTF_CSRF_ENABLED'] = False
+        if not api.app.config.get('SECRET_KEY'):
+            api.app.config['SECRET_KEY'] = 'bench'
+        self.app = api.app
+        self._local = threading.local()
+
+    def send(self, request):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        method = request.get('method', 'POST')
+        if 'form' in request:
+            response = client.open(request['path'], method=method, data=request['form'])
+        elif 'body' in request:
+            response = client.open(request['path'], method=method, data=request['body'],
+                                   content_type=request.get('content_type'))
+        else:
+            response = client.open(request['path'], method=method, json=request.get('json'))
+        return response.status_code
+
+
+class HttpClient:
+    """ sends requests over HTTP, keeping a cookie session per thread for csrf """
+
+    CSRF_RE = re.compile(rb'name="csrf_token"[^>]*value="([^"]+)"')
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            opener = urllib.request.build_opener(
+                urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            session = self._local.session = {'opener': opener, 'csrf': {}}
+        return session
+
+    def _csrf_token(self, session, path):
+        if path not in session['csrf']:
+            with session['opener'].open(self.url + path) as response:
+                match = self.CSRF_RE.search(response.read())
+            session['csrf'][path] = match.group(1).decode() if match else ''
+        return session['csrf'][path]
+
+    def send(self, request):
+        session = self._session()
+        method = request.get('method', 'POST')
+        if 'form' in request:
+            form = dict(request['form'], csrf_token=self._csrf_token(session, request['path']))
+            data = urllib.parse.urlencode(form).encode()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        elif 'body' in request:
+            data = request['body'].encode()
+            headers = {'Content-Type': request.get('content_type') or 'application/json'}
+        else:
+            data = json.dumps(request.get('json')).encode()
+            headers = {'Content-Type': 'application/json'}
+
+        req = urllib.request.Request(self.url + request['path'], data=data, headers=headers, method=method)
+        try:
+            with session['opener'].open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+def start_local_server(port):
+    """ starts api.py in a threaded werkzeug server in a child process """
+
+    code = (
+        'import api\n'
+        'from werkzeug.serving import make_server\n'
+        f'make_server("127.0.0.1", {port}, api.app, threaded=True).serve_forever()\n'
+    )
+    env = dict(os.environ, SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'))
+    process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(url + '/api/v1/models').read()
+            return process, url
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                raise RuntimeError('local server exited during startup')
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('local server did not start')
+
+
+STARTUP_CODE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import api
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'sklearn_imported': 'sklearn' in sys.modules,
+    'pandas_imported': 'pandas' in sys.modules,
+}))
+"""
+
+
+def measure_startup(repeats, formats=('pickle', 'native')):
+    """ cold start time and peak rss of a fresh process importing api.py """
+
+    results = {}
+    for fmt in formats:
+        runs = []
+        for _ in range(repeats):
+            env = dict(os.environ, MODEL_FORMAT=fmt, LOG_LEVEL='WARNING')
+            output = subprocess.run([sys.executable, '-W', 'ignore', '-c', STARTUP_CODE], env=env,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[fmt] = {
+            'runs': repeats,
+            'median_seconds': round(float(np.median([r['seconds'] for r in runs])), 4),
+            'median_max_rss_mb': round(float(np.median([r['max_rss_mb'] for r in runs])), 1),
+            'sklearn_imported': runs[-1]['sklearn_imported'],
+            'pandas_imported': runs[-1]['pandas_imported'],
+        }
+    return results
+
+
+def run(client, requests, concurrency):
+    """ sends every request, returns (path, status, seconds) samples and wall time """
+
+    def send(request):
+        start = time.perf_counter()
+        try:
+            status = client.send(request)
+        except Exception:
+            status = 0
+        return request['path'], status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = list(pool.map(send, requests))
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, wall):
+    """ throughput and latency percentiles per endpoint and overall """
+
+    def stats(rows):
+        latencies = np.array([seconds for _, _, seconds in rows]) * 1000
+        statuses = {}
+        for _, status, _ in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {
+            'count': len(rows),
+            'errors': sum(1 for _, status, _ in rows if not 200 <= status < 300),
+            'status_counts': statuses,
+            'throughput_rps': round(len(rows) / wall, 2),
+            'mean_ms': round(float(latencies.mean()), 3),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+            'max_ms': round(float(latencies.max()), 3),
+        }
+
+    by_path = {}
+    for sample in samples:
+        by_path.setdefault(sample[0], []).append(sample)
+    return {
+        'endpoints': {path: stats(rows) for path, rows in sorted(by_path.items())},
+        'total': stats(samples),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_report(results, baseline=None):
+    header = f'{"endpoint":<34}{"count":>7}{"err":>6}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+    print(header)
+    print('-' * len(header))
+    rows = dict(results['endpoints'], total=results['total'])
+    for path, s in rows.items():
+        print(f'{path:<34}{s["count"]:>7}{s["errors"]:>6}{s["throughput_rps"]:>10}'
+              f'{s["p50_ms"]:>10}{s["p95_ms"]:>10}{s["p99_ms"]:>10}')
+        if baseline is None:
+            continue
+        old = baseline['total'] if path == 'total' else baseline['endpoints'].get(path)
+        if old:
+            deltas = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                change = (s[key] - old[key]) / old[key] * 100 if old[key] else 0
+                deltas.append(f'{key} {change:+.1f}%')
+            print(f'{"  vs baseline":<34}' + ', '.join(deltas))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the HouzStack prediction routes')
+    parser.add_argument('--replay', help='jsonl request log to replay instead of synthetic traffic')
+    parser.add_argument('--requests', type=int, default=2000, help='number of requests to send')
+    parser.add_argument('--routes', default=','.join(DEFAULT_ROUTES),
+                        help=f'synthetic routes to hit, from {",".join(ROUTES)}')
+    parser.add_argument('--batch-size', type=int, default=50, help='listings per synthetic batch request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--target', choices=['inprocess', 'http'], default='inprocess')
+    parser.add_argument('--url', help='server to benchmark, a local server is started when omitted')
+    parser.add_argument('--port', type=int, default=5055, help='port of the local server')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=100, help='requests sent before measuring')
+    parser.add_argument('--output', help='file the json results are written to')
+    parser.add_argument('--compare', help='earlier json results to compare against')
+    parser.add_argument('--startup', type=int, metavar='REPEATS',
+                        help='measure cold start and memory per model format instead of load testing')
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results = {'startup': measure_startup(args.startup),
+                   'meta': {'timestamp': datetime.now(timezone.utc).isoformat(), 'commit': git_commit()}}
+        for fmt, s in results['startup'].items():
+            print(f'{fmt:<8} cold start {s["median_seconds"]:.3f}s  max rss {s["median_max_rss_mb"]:.1f} MB  '
+                  f'sklearn imported: {s["sklearn_imported"]}')
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return
+
+    if args.replay:
+        requests = replay_requests(args.replay, limit=args.requests)
+    else:
+        routes = args.routes.split(',')
+        unknown = [r for r in routes if r not in ROUTES]
+        if unknown:
+            parser.error(f'unknown routes {unknown}')
+        requests = synthetic_requests(args.requests, routes, seed=args.seed, batch_size=args.batch_size)
+    if not requests:
+        parser.error('no requests to send')
+
+    server = None
+    if args.target == 'http':
+        if args.url:
+            url = args.url
+        else:
+            server, url = start_local_server(args.port)
+        client = HttpClient(url)
+    else:
+        client = InProcessClient()
+
+    try:
+        run(client, requests[:args.warmup], args.concurrency)
+        samples, wall = run(client, requests, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    results = summarize(samples, wall)
+    results['meta'] = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'source': args.replay or 'synthetic',
+        'target': args.target if args.url is None else args.url,
+        'concurrency': args.concurrency,
+        'requests': len(requests),
+        'wall_seconds': round(wall, 3),
+        'env': {k: v for k, v in os.environ.items()
+                if k.startswith(('PREDICTION_', 'MICRO_BATCH', 'MODEL_', 'BATCH_'))},
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
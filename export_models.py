@@ -0,0 +1,92 @@
+""" converts the pickled sklearn-wrapper models to native xgboost boosters
+
+writes models/<name>.ubj (or .json) and a models/<name>.meta.json sidecar
+holding the feature names, dtypes, training MAE and version, which the api
+loads without importing sklearn:
+
+    python export_models.py
+    python export_models.py --format json --version 2024.08
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+from registry import BASE_DIR, load_joblib, load_pickle, metadata_path
+
+
+# (artifact, loader) of the models trained in the notebooks
+SOURCES = {
+    'nigeria': ('nigerira.plk', load_joblib),
+    'uk': ('model_uk.plk', load_pickle),
+}
+
+# mean absolute error on the test split, as reported by the training notebooks
+TRAINING_MAE = {
+    'nigeria': 3306203.003614955,
+    'uk': 1310.1139475464158,
+}
+
+
+def write_metadata(path, name, booster, version=None, training_mae=None, **extra):
+    """ writes the metadata sidecar of a native model saved at `path` """
+
+    import xgboost as xgb
+
+    with open(path, 'rb') as f:
+        checksum = hashlib.sha256(f.read()).hexdigest()
+    metadata = {
+        'model': name,
+        'version': version or checksum[:12],
+        'checksum': checksum,
+        'format': os.path.splitext(path)[1].lstrip('.'),
+        'features': booster.feature_names,
+        'dtypes': dict(zip(booster.feature_names, booster.feature_types or [])),
+        'training_mae': training_mae,
+        'xgboost_version': xgb.__version__,
+        'exported_at': datetime.now(timezone.utc).isoformat(),
+    }
+    metadata.update(extra)
+    with open(metadata_path(path), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
+
+
+def export(name, output_dir, fmt='ubj', version=None):
+    """ exports one model, returns the path of the native booster """
+
+    source, loader = SOURCES[name]
+    booster = loader(os.path.join(BASE_DIR, source)).get_booster()
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f'{name}.{fmt}')
+    # written next to the served file first, xgboost picks the format from the extension
+    staged = os.path.join(output_dir, f'.{name}.tmp.{fmt}')
+    booster.save_model(staged)
+    write_metadata(staged, name, booster, version=version,
+                   training_mae=TRAINING_MAE.get(name), source=source)
+
+    # swapped in with os.replace so a running registry never reads a half-written
+    # artifact, the sidecar goes first because the registry reads it when the model changes
+    os.replace(metadata_path(staged), metadata_path(path))
+    os.replace(staged, path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='export the models in native xgboost format')
+    parser.add_argument('models', nargs='*', default=list(SOURCES), help='models to export')
+    parser.add_argument('--format', choices=['ubj', 'json'], default='ubj')
+    parser.add_argument('--output-dir', default=os.path.join(BASE_DIR, 'models'))
+    parser.add_argument('--version', help='version recorded in the metadata, defaults to the checksum')
+    args = parser.parse_args(argv)
+
+    for name in args.models:
+        path = export(name, args.output_dir, args.format, args.version)
+        print(f'exported {name} to {os.path.relpath(path)}')
+
+
+if __name__ == '__main__':
+    main()
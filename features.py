@@ -0,0 +1,242 @@
+""" declarative feature schemas used to validate and encode inputs
+
+every model has one schema describing its columns (in training order), the
+json/form key each column is read from and how the value is encoded. single
+rows are encoded straight into a preallocated float32 buffer, ready for the
+booster's in-place predict, without building a DataFrame.
+"""
+
+import json
+import math
+import threading
+
+import numpy as np
+
+
+class MissingFieldError(ValueError):
+    """ raised when a required input field is absent """
+
+    def __init__(self, key):
+        super().__init__(f'{key} field is required')
+        self.key = key
+
+
+class InvalidFieldError(ValueError):
+    """ raised when an input field cannot be encoded """
+
+    def __init__(self, key, message):
+        super().__init__(message)
+        self.key = key
+
+
+def parse_number(value):
+    """ finite float value of a numeric input, None when it is not a number
+
+    booleans are rejected although python treats them as 0 and 1
+    """
+
+    if isinstance(value, (bool, np.bool_)):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+class Feature:
+    """ one model column and the input field it is encoded from
+
+    kinds:
+        flag          'yes' (any case) encodes to 1, anything else to 0
+        int           whole number
+        positive_int  whole number greater than zero
+    """
+
+    KINDS = ('flag', 'int', 'positive_int')
+
+    def __init__(self, column, key, kind, grid=None):
+        if kind not in self.KINDS:
+            raise ValueError(f'unknown feature kind {kind}')
+        self.column = column
+        self.key = key
+        self.kind = kind
+        # inclusive (low, high) range of realistic values, used by the prediction table
+        self.grid = (0, 1) if kind == 'flag' else grid
+
+    @property
+    def error_message(self):
+        if self.kind == 'positive_int':
+            return f'{self.key} field must be a positive number'
+        return f'{self.key} field must be a number'
+
+    def encode(self, value):
+        """ encodes a single input value into its float value """
+
+        if value is None or value == '':
+            raise MissingFieldError(self.key)
+
+        if self.kind == 'flag':
+            return 1.0 if str(value).lower() == 'yes' else 0.0
+
+        number = parse_number(value)
+        if number is None or not number.is_integer():
+            raise InvalidFieldError(self.key, self.error_message)
+        if self.kind == 'positive_int' and number <= 0:
+            raise InvalidFieldError(self.key, self.error_message)
+        return number
+
+    def encode_column(self, raw):
+        """ encodes a column of raw values, returns (values, missing, invalid)
+
+        accepts and rejects exactly the values `encode` does
+        """
+
+        missing = np.fromiter((v is None or (isinstance(v, str) and v == '') for v in raw),
+                              dtype=bool, count=len(raw))
+        if self.kind == 'flag':
+            values = (raw.astype(str).str.lower() == 'yes').to_numpy(dtype=np.float32)
+            return values, missing, missing
+
+        import pandas as pd
+
+        try:
+            numbers = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float, copy=True)
+        except OverflowError:
+            numbers = np.full(len(raw), np.nan)
+        # pandas reads booleans as 0 and 1
+        booleans = np.fromiter((isinstance(v, (bool, np.bool_)) for v in raw), dtype=bool, count=len(raw))
+        numbers[booleans] = np.nan
+        # values pandas cannot parse but float() can, like '1_000', go through the scalar rule
+        for i in np.flatnonzero(np.isnan(numbers) & ~missing & ~booleans):
+            number = parse_number(raw.iat[i])
+            if number is not None:
+                numbers[i] = number
+
+        invalid = missing | ~np.isfinite(numbers) | (numbers != np.floor(numbers))
+        if self.kind == 'positive_int':
+            invalid |= numbers <= 0
+        return np.where(invalid, 0, numbers).astype(np.float32), missing, invalid
+
+
+class FeatureSchema:
+    """ ordered set of features a model was trained on """
+
+    def __init__(self, name, features):
+        self.name = name
+        self.features = features
+        self.columns = [f.column for f in features]
+        self.keys = [f.key for f in features]
+        self._local = threading.local()
+
+    def check(self, booster):
+        """ makes sure the booster was trained on exactly these columns
+
+        the fast path passes bare arrays, so a mismatch here would otherwise
+        silently feed values into the wrong columns
+        """
+
+        if booster.feature_names != self.columns:
+            raise ValueError(
+                f'{self.name} model features {booster.feature_names} do not '
+                f'match the schema {self.columns}'
+            )
+
+    def encode(self, data):
+        """ encodes one listing (json object or form) into the row buffer
+
+        the buffer is preallocated once per thread and reused, so the
+        returned array is only valid until the next call on this thread
+        """
+
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty((1, len(self.features)), dtype=np.float32)
+
+        row = buffer[0]
+        for i, feature in enumerate(self.features):
+            row[i] = feature.encode(data.get(feature.key))
+        return buffer
+
+    def encode_batch(self, listings, errors=None):
+        """ validates and encodes a batch of listings one column at a time
+
+        `errors` maps the indices of rows rejected before encoding (such as
+        unparseable lines) to their error. returns a float32 matrix holding
+        only the valid rows (in model column order), the original indices of
+        those rows and a list of row errors
+        """
+
+        n = len(listings)
+        errors = dict(errors or {})
+        records = []
+        for i, listing in enumerate(listings):
+            if i not in errors and isinstance(listing, dict):
+                records.append(listing)
+            else:
+                records.append({})
+                errors.setdefault(i, 'listing must be a json object')
+
+        import pandas as pd
+
+        matrix = np.empty((n, len(self.features)), dtype=np.float32)
+        rejected = np.zeros(n, dtype=bool)
+        for j, feature in enumerate(self.features):
+            raw = pd.Series([r.get(feature.key) for r in records], dtype=object)
+            values, missing, invalid = feature.encode_column(raw)
+
+            for i in np.flatnonzero(invalid & ~rejected):
+                if i not in errors:
+                    errors[i] = str(MissingFieldError(feature.key)) if missing[i] else feature.error_message
+            rejected |= invalid
+            matrix[:, j] = values
+
+        for i in errors:
+            rejected[i] = True
+        valid = np.flatnonzero(~rejected)
+        row_errors = [{'index': int(i), 'error': errors[i]} for i in sorted(errors)]
+        return matrix[valid], valid.tolist(), row_errors
+
+
+NIGERIA_SCHEMA = FeatureSchema('nigeria', [
+    Feature('Serviced', 'serviced', 'flag'),
+    Feature('Newly Built', 'newly_built', 'flag'),
+    Feature('Furnished', 'furnished', 'flag'),
+    Feature('Bedrooms', 'bedrooms', 'int', grid=(0, 10)),
+    Feature('Bathrooms', 'bathrooms', 'int', grid=(0, 10)),
+    Feature('Toilets', 'toilets', 'int', grid=(0, 10)),
+])
+
+UK_SCHEMA = FeatureSchema('uk', [
+    Feature('Number of Rooms', 'bedrooms', 'positive_int', grid=(1, 20)),
+])
+
+SCHEMAS = {schema.name: schema for schema in (NIGERIA_SCHEMA, UK_SCHEMA)}
+
+
+def parse_listings(body, content_type):
+    """ parses a batch body, either a json array or ndjson (one object per line)
+
+    returns the listings and a dict of row errors for ndjson lines that are
+    not valid json (their listing is None), so one bad line does not reject
+    the batch. raises ValueError when a json array body cannot be parsed
+    """
+
+    text = body.decode('utf-8') if isinstance(body, bytes) else body
+    if 'ndjson' in (content_type or '') or 'jsonlines' in (content_type or ''):
+        listings = []
+        errors = {}
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                listings.append(json.loads(line))
+            except ValueError as e:
+                errors[len(listings)] = f'line is not valid json: {e}'
+                listings.append(None)
+        return listings, errors
+
+    listings = json.loads(text)
+    if not isinstance(listings, list):
+        raise ValueError('body must be a json array of listings')
+    return listings, {}
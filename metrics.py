@@ -0,0 +1,273 @@
+""" lightweight request metrics rendered in the prometheus text format
+
+counters are always recorded. per-stage timings are only recorded for a
+sampled fraction of requests (`sample_rate`), unsampled requests get a timer
+whose `mark` does nothing, so the hot path cost is a single random() call.
+
+in a preforked server every worker has its own counters; `Metrics.share`
+makes the workers write snapshots to a shared directory that every scrape
+merges, so any worker answers with the totals of all of them.
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from background import ProcessThread
+
+
+# histogram bucket upper bounds in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{k}="{str(v)}"' for k, v in labels)
+    return '{' + pairs + '}'
+
+
+class Histogram:
+    """ cumulative-bucket histogram of durations in seconds """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def merge(self, counts, total, count):
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        self.sum += total
+        self.count += count
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class StageTimer:
+    """ records the time spent between successive marks as stage durations """
+
+    def __init__(self, metrics, route, model):
+        self.metrics = metrics
+        self.labels = (('route', route), ('model', model))
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe('stage_seconds', self.labels + (('stage', stage),), now - self.last)
+        self.last = now
+
+
+class NullTimer:
+    """ timer handed to unsampled requests """
+
+    def mark(self, stage):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """ process-wide registry of counters and histograms """
+
+    HELP = {
+        'requests_total': ('counter', 'requests handled, by route and status'),
+        'errors_total': ('counter', 'requests that failed with an error other than validation'),
+        'validation_failures_total': ('counter', 'requests rejected by input validation'),
+        'request_seconds': ('histogram', 'total request duration of sampled requests'),
+        'stage_seconds': ('histogram', 'duration of each stage of sampled requests'),
+    }
+
+    def __init__(self, prefix='houzstack', sample_rate=1.0):
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        # set by share()
+        self.directory = None
+        self._collect = None
+        self._writer = None
+
+    def sampled(self):
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def timer(self, route, model, sampled=None):
+        """ a StageTimer for sampled requests, a no-op timer otherwise """
+
+        if sampled is None:
+            sampled = self.sampled()
+        if sampled:
+            return StageTimer(self, route, model)
+        return NULL_TIMER
+
+    def share(self, directory, collect=None, interval=1.0):
+        """ merges the metrics of every worker process on each scrape
+
+        each process writes its counters, histograms and the samples returned
+        by `collect` (the `extra` of render) to `<directory>/<pid>.json` every
+        `interval` seconds and when it exits. counters of workers that have
+        exited are kept so totals never go down; gauges are only reported for
+        live workers, labelled with their `worker` pid
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._collect = collect
+        self.interval = interval
+        self._writer = ProcessThread(self._share, 'metrics', on_start=lambda: atexit.register(self.write_snapshot))
+
+    def inc(self, name, labels=(), value=1):
+        if self._writer is not None:
+            self._writer.ensure_started()
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self, extra=()):
+        """ prometheus text exposition of every metric
+
+        `extra` holds (name, type, help, [(labels, value)]) tuples for
+        gauges computed at scrape time
+        """
+
+        if self.directory is None:
+            with self._lock:
+                counters = dict(self._counters)
+                histograms = dict(self._histograms)
+            return self._render(counters, histograms, extra)
+
+        self.write_snapshot(extra)
+        return self._render(*self._merge_snapshots())
+
+    def write_snapshot(self, extra=None):
+        """ writes this process's metrics to the shared directory """
+
+        if extra is None:
+            extra = self._collect() if self._collect is not None else ()
+        with self._lock:
+            snapshot = {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, h.counts, h.sum, h.count]
+                               for (name, labels), h in self._histograms.items()],
+            }
+        snapshot['extra'] = [list(item) for item in extra]
+
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def _share(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write_snapshot()
+            except Exception:
+                logging.exception('writing the metrics snapshot failed')
+
+    def _merge_snapshots(self):
+        counters = {}
+        histograms = {}
+        extra = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            pid = int(os.path.basename(path).split('.')[0])
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            for name, labels, value in snapshot['counters']:
+                key = (name, as_labels(labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total, count in snapshot['histograms']:
+                histogram = histograms.setdefault((name, as_labels(labels)), Histogram())
+                histogram.merge(counts, total, count)
+
+            alive = pid_alive(pid)
+            for name, kind, text, samples in snapshot['extra']:
+                merged = extra.setdefault(name, (kind, text, {}))[2]
+                for labels, value in samples:
+                    labels = as_labels(labels)
+                    if kind == 'counter':
+                        merged[labels] = merged.get(labels, 0) + value
+                    elif alive:
+                        merged[labels + (('worker', pid),)] = value
+
+        extra = [(name, kind, text, list(samples.items())) for name, (kind, text, samples) in extra.items()]
+        return counters, histograms, extra
+
+    def _render(self, counters, histograms, extra):
+        lines = []
+        counters = sorted(counters.items())
+        histograms = sorted(histograms.items(), key=lambda item: item[0])
+        for name, (kind, text) in self.HELP.items():
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {text}')
+            lines.append(f'# TYPE {full} {kind}')
+            if kind == 'counter':
+                for (n, labels), value in counters:
+                    if n == name:
+                        lines.append(f'{full}{format_labels(labels)} {value}')
+            else:
+                for (n, labels), histogram in histograms:
+                    if n == name:
+                        lines.extend(histogram.render(full, labels))
+
+        for name, kind, text, samples in extra:
+            full = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full} {text}')
+            lines.append(f'# TYPE {full} {kind}')
+            for labels, value in samples:
+                lines.append(f'{full}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def as_labels(pairs):
+    """ label pairs read back from json as a hashable tuple """
+
+    return tuple((name, value) for name, value in pairs)
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
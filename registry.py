@@ -0,0 +1,269 @@
+""" process-wide registry that keeps the prediction models in memory """
+
+import ctypes
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# set once xgboost was imported without its sklearn integration
+_lean_xgboost = False
+
+
+def require_sklearn_xgboost():
+    """ refuses to go on when xgboost was imported by import_xgboost(lean=True) """
+
+    if _lean_xgboost:
+        raise RuntimeError(
+            'xgboost was imported without sklearn (import_xgboost(lean=True)), '
+            'pickled sklearn models cannot be loaded in this process'
+        )
+
+
+def load_joblib(path):
+    """ loads a model dumped with joblib (the Nigeria model) """
+
+    require_sklearn_xgboost()
+    import joblib
+
+    return joblib.load(path)
+
+
+def load_pickle(path):
+    """ loads a model dumped with pickle (the UK model) """
+
+    require_sklearn_xgboost()
+    with open(path, 'rb') as m:
+        return pickle.load(m)
+
+
+def import_xgboost(lean=False):
+    """ imports xgboost, optionally without its sklearn and pandas integrations
+
+    xgboost imports sklearn and pandas eagerly when they are installed, which
+    is most of a worker's cold start. native boosters scored with numpy need
+    neither, so a lean import hides them while xgboost loads. pickled sklearn
+    models cannot be loaded in a process that imported xgboost this way, the
+    pickle loaders refuse to run afterwards.
+    """
+
+    global _lean_xgboost
+
+    if lean and 'xgboost' not in sys.modules:
+        hidden = [name for name in ('sklearn', 'pandas') if name not in sys.modules]
+        for name in hidden:
+            sys.modules[name] = None
+        try:
+            import xgboost
+        finally:
+            for name in hidden:
+                del sys.modules[name]
+        _lean_xgboost = bool(hidden)
+
+    import xgboost
+    return xgboost
+
+
+def load_booster(path):
+    """ loads a native xgboost booster (ubj or json) from a memory-mapped file
+
+    the file is handed to xgboost straight from the page cache instead of
+    being read into a python bytes object first; only xgboost itself is
+    imported, not the sklearn wrapper stack.
+
+    this goes through private xgboost internals (checked against the version
+    pinned in requirements.txt); when they are missing or changed the model
+    is loaded from a copy of the mapping with the public api instead
+    """
+
+    xgb = import_xgboost()
+
+    booster = xgb.Booster()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) as mapped:
+        try:
+            from xgboost.core import _LIB, _check_call, c_bst_ulong
+
+            buffer = (ctypes.c_char * len(mapped)).from_buffer(mapped)
+            try:
+                _check_call(_LIB.XGBoosterLoadModelFromBuffer(booster.handle, buffer, c_bst_ulong(len(mapped))))
+            finally:
+                # the mapping cannot be closed while a ctypes view exports it
+                del buffer
+        except (ImportError, AttributeError, TypeError, ctypes.ArgumentError) as e:
+            logging.warning(f'loading {path} without mmap, xgboost {xgb.__version__} internals changed: {e}')
+            booster.load_model(bytearray(mapped))
+    return booster
+
+
+def metadata_path(path):
+    """ path of the metadata sidecar written next to a native model """
+
+    return os.path.splitext(path)[0] + '.meta.json'
+
+
+def read_metadata(path):
+    """ reads the metadata sidecar of a model, empty when there is none """
+
+    try:
+        with open(metadata_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def file_checksum(path):
+    """ returns the sha256 hex digest of a file """
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelEntry:
+    """ a snapshot of one loaded model artifact
+
+    views take a reference to an entry and keep using it for the whole
+    request, so swapping in a new entry never affects in-flight requests
+    """
+
+    def __init__(self, name, path, model, checksum, mtime, size):
+        self.name = name
+        self.path = path
+        self.model = model
+        # bare booster used by the fast path, the sklearn wrapper is kept for .predict
+        self.booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        # precomputed predictions, attached by a listener when enabled
+        self.table = None
+        self.checksum = checksum
+        metadata = read_metadata(path)
+        # a sidecar left over from another artifact must not describe this one
+        self.metadata = metadata if metadata.get('checksum') == checksum else {}
+        self.version = self.metadata.get('version') or checksum[:12]
+        self.mtime = mtime
+        self.size = size
+        self.loaded_at = datetime.now(timezone.utc)
+
+    def info(self):
+        """ json serialisable description of the entry """
+
+        return {
+            'name': self.name,
+            'path': os.path.relpath(self.path, BASE_DIR),
+            'version': self.version,
+            'checksum': self.checksum,
+            'loaded_at': self.loaded_at.isoformat(),
+            'metadata': self.metadata,
+        }
+
+
+class ModelRegistry:
+    """ loads each registered artifact once and hot-swaps it when it changes
+
+    the artifact is re-checked at most once every `check_interval` seconds
+    on access; a changed mtime/size triggers a checksum and, if the content
+    really changed, a reload that replaces the entry in a single assignment
+    """
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._specs = {}
+        self._entries = {}
+        self._last_check = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def register(self, name, path, loader):
+        """ registers an artifact under `name`, path is relative to the repo """
+
+        if loader in (load_joblib, load_pickle):
+            # failing here is clearer than failing inside the unpickler at load time
+            require_sklearn_xgboost()
+        if not os.path.isabs(path):
+            path = os.path.join(BASE_DIR, path)
+        self._specs[name] = (path, loader)
+
+    def add_listener(self, callback):
+        """ calls `callback(entry)` every time a model is (re)loaded
+
+        callbacks run before the entry is swapped in, an exception rejects it
+        """
+
+        self._listeners.append(callback)
+
+    def load_all(self):
+        """ eagerly loads every registered model, used at startup """
+
+        for name in self._specs:
+            self.get(name)
+
+    def names(self):
+        return list(self._specs)
+
+    def get(self, name):
+        """ returns the current ModelEntry for `name` """
+
+        entry = self._entries.get(name)
+        if entry is not None:
+            now = time.monotonic()
+            if now - self._last_check.get(name, 0) < self.check_interval:
+                return entry
+            self._last_check[name] = now
+            if not self._changed(entry):
+                return entry
+
+        with self._lock:
+            current = self._entries.get(name)
+            if current is not entry:
+                # another thread already swapped it while we waited
+                return current
+            return self._load(name, entry)
+
+    def info(self):
+        """ versions and load times of every loaded model """
+
+        return {name: entry.info() for name, entry in self._entries.items()}
+
+    def _changed(self, entry):
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            logging.warning(f'model artifact {entry.path} is missing, keeping loaded version')
+            return False
+        return stat.st_mtime != entry.mtime or stat.st_size != entry.size
+
+    def _load(self, name, previous=None):
+        path, loader = self._specs[name]
+        stat = os.stat(path)
+        checksum = file_checksum(path)
+
+        if previous is not None and previous.checksum == checksum:
+            # touched but identical, only remember the new stat
+            previous.mtime, previous.size = stat.st_mtime, stat.st_size
+            return previous
+
+        try:
+            entry = ModelEntry(name, path, loader(path), checksum, stat.st_mtime, stat.st_size)
+            for callback in self._listeners:
+                callback(entry)
+        except Exception:
+            if previous is None:
+                raise
+            # a half-written or incompatible artifact must not take the service down
+            logging.exception(f'reloading model {name} failed, keeping version {previous.version}')
+            return previous
+
+        self._entries[name] = entry
+        self._last_check[name] = time.monotonic()
+        logging.info(f'loaded model {name} version {entry.version}')
+        return entry
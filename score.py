@@ -0,0 +1,246 @@
+""" bulk scoring of large listing files with a process pool
+
+the input (csv or jsonl, one listing per row/line, with the same fields as the
+json api) is streamed in fixed-size chunks that are encoded and scored by a
+pool of worker processes, each loading the model once. only a bounded number
+of chunks is in flight, and results are appended to the output in input order,
+so memory use does not depend on the size of the input.
+
+after every chunk a checkpoint is written next to the output; `--resume`
+continues from the last completed chunk after a crash:
+
+    python score.py nigeria listings.csv scored.csv --workers 4
+    python score.py uk listings.jsonl scored.jsonl --resume
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from features import SCHEMAS
+from registry import BASE_DIR
+
+
+# set in every worker process by init_worker
+_worker = {}
+
+
+def file_format(path, override=None):
+    if override:
+        return override
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError(f'cannot tell the format of {path}, pass --input-format/--output-format')
+
+
+def default_model_path(name):
+    native = os.path.join(BASE_DIR, 'models', f'{name}.ubj')
+    if os.path.exists(native):
+        return native
+    return os.path.join(BASE_DIR, {'nigeria': 'nigerira.plk', 'uk': 'model_uk.plk'}[name])
+
+
+def load_model(path):
+    """ loads a native booster or a pickled sklearn model, returns the booster """
+
+    from registry import load_booster, load_joblib
+
+    if path.endswith(('.ubj', '.json')):
+        return load_booster(path)
+    # joblib also reads plain pickles
+    return load_joblib(path).get_booster()
+
+
+def init_worker(name, model_path, nthread):
+    booster = load_model(model_path)
+    booster.set_param({'nthread': nthread})
+    SCHEMAS[name].check(booster)
+    _worker.update(name=name, booster=booster)
+
+
+def score_chunk(chunk, input_format, output_format, fieldnames):
+    """ encodes and scores one chunk in a worker, returns the formatted output text """
+
+    schema = SCHEMAS[_worker['name']]
+    rejected = {}
+    if input_format == 'jsonl':
+        records = []
+        for line in chunk:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                rejected[len(records)] = 'line is not valid json'
+                records.append(None)
+    else:
+        records = chunk
+
+    # model column names are accepted as well as the api field names
+    renames = dict(zip(schema.columns, schema.keys))
+    listings = [
+        {renames.get(k, k): v for k, v in record.items()} if isinstance(record, dict) else record
+        for record in records
+    ]
+
+    matrix, indices, errors = schema.encode_batch(listings, rejected)
+    rents = [None] * len(records)
+    if indices:
+        for i, rent in zip(indices, _worker['booster'].inplace_predict(matrix).tolist()):
+            rents[i] = int(rent)
+    messages = [None] * len(records)
+    for error in errors:
+        messages[error['index']] = error['error']
+
+    out = io.StringIO()
+    if output_format == 'jsonl':
+        for record, rent, message in zip(records, rents, messages):
+            row = dict(record) if isinstance(record, dict) else {}
+            row.update(rent=rent, error=message)
+            out.write(json.dumps(row) + '\n')
+    else:
+        writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction='ignore')
+        for record, rent, message in zip(records, rents, messages):
+            row = dict(record) if isinstance(record, dict) else {}
+            row.update(rent='' if rent is None else rent, error=message or '')
+            writer.writerow(row)
+    return out.getvalue(), len(records)
+
+
+def read_chunks(path, input_format, chunksize, skip_rows):
+    """ yields lists of raw jsonl lines or csv records, starting after `skip_rows` rows
+
+    rows are counted the way they are scored (blank lines are not rows), so
+    skipped rows are parsed and dropped rather than skipped as file lines
+    """
+
+    if input_format == 'jsonl':
+        with open(path) as f:
+            lines = (line for line in f if line.strip())
+            lines = itertools.islice(lines, skip_rows, None)
+            while True:
+                chunk = list(itertools.islice(lines, chunksize))
+                if not chunk:
+                    return
+                yield chunk
+    else:
+        import pandas as pd
+
+        reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunksize)
+        for df in reader:
+            if skip_rows >= len(df):
+                skip_rows -= len(df)
+                continue
+            records = df.to_dict('records')[skip_rows:]
+            skip_rows = 0
+            yield records
+
+
+def csv_fieldnames(path):
+    with open(path, newline='') as f:
+        header = next(csv.reader(f), [])
+    return header + [name for name in ('rent', 'error') if name not in header]
+
+
+class Checkpoint:
+    """ progress of a scoring run, written atomically after every chunk """
+
+    def __init__(self, output):
+        self.path = output + '.progress'
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='score a large listing file with a process pool')
+    parser.add_argument('model', choices=list(SCHEMAS))
+    parser.add_argument('input', help='csv or jsonl file of listings')
+    parser.add_argument('output', help='csv or jsonl file the scored listings are appended to')
+    parser.add_argument('--model-path', help='model artifact, defaults to the one the api serves')
+    parser.add_argument('--input-format', choices=['csv', 'jsonl'])
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'])
+    parser.add_argument('--chunksize', type=int, default=10_000, help='listings per chunk')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--nthread', type=int, default=1, help='xgboost threads per worker')
+    parser.add_argument('--max-in-flight', type=int, default=0,
+                        help='chunks queued or being scored at once, defaults to 2 x workers')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run')
+    args = parser.parse_args(argv)
+
+    input_format = file_format(args.input, args.input_format)
+    output_format = file_format(args.output, args.output_format)
+    if input_format == 'csv':
+        fieldnames = csv_fieldnames(args.input)
+    else:
+        fieldnames = SCHEMAS[args.model].keys + ['rent', 'error']
+    max_in_flight = args.max_in_flight or 2 * args.workers
+    model_path = args.model_path or default_model_path(args.model)
+
+    checkpoint = Checkpoint(args.output)
+    state = {'input': os.path.abspath(args.input), 'model': args.model, 'chunksize': args.chunksize,
+             'chunks': 0, 'rows': 0, 'output_bytes': 0}
+    if args.resume and (previous := checkpoint.load()):
+        if previous['input'] != state['input'] or previous['model'] != args.model:
+            parser.error(f'{checkpoint.path} belongs to a different input or model')
+        state = previous
+        print(f'resuming after chunk {state["chunks"]} ({state["rows"]} rows)')
+    elif os.path.exists(args.output) and not args.resume:
+        os.remove(args.output)
+
+    out = open(args.output, 'ab')
+    # anything written after the last checkpoint belongs to an unfinished chunk
+    out.truncate(state['output_bytes'])
+    out.seek(state['output_bytes'])
+    if state['output_bytes'] == 0 and output_format == 'csv':
+        header = io.StringIO()
+        csv.DictWriter(header, fieldnames=fieldnames).writeheader()
+        out.write(header.getvalue().encode())
+
+    chunks = read_chunks(args.input, input_format, args.chunksize, state['rows'])
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(args.model, model_path, args.nthread)) as pool, out:
+        pending = deque()
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                pending.append(pool.submit(score_chunk, chunk, input_format, output_format, fieldnames))
+                if len(pending) < max_in_flight:
+                    continue
+            # writing finished chunks in input order, which also bounds the chunks in memory
+            while pending and (chunk is None or len(pending) >= max_in_flight):
+                text, rows = pending.popleft().result()
+                out.write(text.encode())
+                out.flush()
+                os.fsync(out.fileno())
+                state['chunks'] += 1
+                state['rows'] += rows
+                state['output_bytes'] = out.tell()
+                checkpoint.save(state)
+
+    checkpoint.clear()
+    print(f'scored {state["rows"]} listings in {state["chunks"]} chunks into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
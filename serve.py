@@ -0,0 +1,189 @@
+""" production serving entrypoint: preloads the models, then forks workers
+
+the parent process imports api.py (loading every model), binds the listening
+socket and forks N workers that share it. boosters loaded before the fork are
+shared copy-on-write, so each extra worker costs little memory. xgboost and
+BLAS threads per worker are capped so that workers x threads matches the core
+count instead of every worker using every core for one-row predictions.
+
+    python serve.py --workers 4 --threads-per-worker 1 --port 8000
+"""
+
+import argparse
+import gc
+import glob
+import logging
+import os
+import signal
+import socket
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+
+# environment variables read by the BLAS/OpenMP runtimes when they load
+THREAD_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def pin_threads(threads):
+    """ caps BLAS/OpenMP and xgboost threads, must run before numpy is imported """
+
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    # read by api.py, which sets nthread on every booster it loads
+    os.environ['XGB_NTHREAD'] = str(threads)
+
+
+def bind(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class InFlight:
+    """ wsgi middleware counting the requests whose response is not finished """
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        from werkzeug.wsgi import ClosingIterator
+
+        with self._idle:
+            self.active += 1
+        try:
+            # the server closes the response once it is sent, which ends the request
+            return ClosingIterator(self.app(environ, start_response), self._finished)
+        except BaseException:
+            self._finished()
+            raise
+
+    def _finished(self):
+        with self._idle:
+            self.active -= 1
+            self._idle.notify_all()
+
+    def wait(self, timeout):
+        """ waits until no request is in flight, returns False on timeout """
+
+        with self._idle:
+            return self._idle.wait_for(lambda: self.active == 0, timeout)
+
+
+def run_worker(app, host, port, sock, graceful_timeout):
+    """ serves requests on the inherited socket until terminated
+
+    SIGTERM stops accepting connections, then requests already running get
+    up to `graceful_timeout` seconds to finish
+    """
+
+    from werkzeug.serving import make_server
+
+    in_flight = InFlight(app)
+    server = make_server(host, port, in_flight, threaded=True, fd=sock.fileno())
+
+    def terminate(*_):
+        # shutdown() waits for serve_forever to return, so it cannot run on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.serve_forever()
+    server.server_close()
+    if not in_flight.wait(graceful_timeout):
+        logging.warning(f'worker {os.getpid()} stopped with {in_flight.active} requests in flight')
+
+
+def spawn(app, host, port, sock, graceful_timeout):
+    pid = os.fork()
+    if pid == 0:
+        # leaving through sys.exit rather than os._exit runs the worker's atexit
+        # handlers, which write out the audit records still queued
+        try:
+            run_worker(app, host, port, sock, graceful_timeout)
+        except Exception:
+            logging.exception(f'worker {os.getpid()} failed')
+            sys.exit(1)
+        sys.exit(0)
+    return pid
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='serve the HouzStack api with preforked workers')
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', cores)))
+    parser.add_argument('--threads-per-worker', type=int, default=int(os.getenv('THREADS_PER_WORKER', 0)),
+                        help='xgboost/BLAS threads per worker, defaults to cores // workers')
+    parser.add_argument('--graceful-timeout', type=float, default=float(os.getenv('GRACEFUL_TIMEOUT', 30)),
+                        help='seconds a stopping worker waits for requests in flight')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.threads_per_worker < 0:
+        parser.error('--threads-per-worker cannot be negative')
+
+    threads = args.threads_per_worker or max(1, cores // args.workers)
+    pin_threads(threads)
+
+    # every worker writes its metrics here, so /metrics reports the totals of all of them
+    metrics_dir = os.getenv('METRICS_DIR')
+    temporary = not metrics_dir
+    if temporary:
+        metrics_dir = os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='houzstack-metrics-')
+    for stale in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.remove(stale)
+
+    # preloading before the fork, the workers inherit the loaded boosters
+    import api
+
+    sock = bind(args.host, args.port)
+    # objects created so far are never collected, so the gc does not touch
+    # (and copy) their pages in every worker
+    gc.freeze()
+
+    logging.info(f'serving on http://{args.host}:{args.port} with {args.workers} workers '
+                 f'x {threads} threads ({cores} cores)')
+    workers = {spawn(api.app, args.host, args.port, sock, args.graceful_timeout) for _ in range(args.workers)}
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logging.warning(f'worker {pid} exited with status {status}, restarting it')
+            time.sleep(0.5)
+            workers.add(spawn(api.app, args.host, args.port, sock, args.graceful_timeout))
+
+    if temporary:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+""" precomputed prediction table for the small, discrete input space
+
+both models only take yes/no flags and small room counts, so every realistic
+input can be scored once when a model loads. requests inside the grid are
+answered by an array lookup, anything outside falls back to live inference
+through a bounded LRU cache.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionTable:
+    """ predictions for every point of a schema's feature grid """
+
+    def __init__(self, schema, booster, cache_size=4096):
+        if any(f.grid is None for f in schema.features):
+            raise ValueError(f'{schema.name} schema has features without a grid')
+
+        self.booster = booster
+        self.lows = tuple(f.grid[0] for f in schema.features)
+        self.shape = tuple(f.grid[1] - f.grid[0] + 1 for f in schema.features)
+
+        # row-major strides, the last feature varies fastest
+        strides = []
+        stride = 1
+        for size in reversed(self.shape):
+            strides.append(stride)
+            stride *= size
+        self.strides = tuple(reversed(strides))
+        self._bounds = tuple(zip(self.lows, self.shape, self.strides))
+
+        grid = np.indices(self.shape).reshape(len(self.shape), -1).T + np.array(self.lows)
+        self.values = booster.inplace_predict(grid.astype(np.float32)).astype(np.float64)
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # counters are updated without locking, they are only used for monitoring
+        self.hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def index(self, row):
+        """ flat table index of an encoded row, None when it is outside the grid """
+
+        index = 0
+        for value, (low, size, stride) in zip(row, self._bounds):
+            offset = int(value) - low
+            if offset < 0 or offset >= size:
+                return None
+            index += offset * stride
+        return index
+
+    def predict(self, row):
+        """ prediction for one encoded row (a 1d sequence in column order) """
+
+        index = self.index(row)
+        if index is not None:
+            self.hits += 1
+            return float(self.values[index])
+
+        key = tuple(float(v) for v in row)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._cache[key]
+
+        self.misses += 1
+        prediction = float(self.booster.inplace_predict(np.array([key], dtype=np.float32))[0])
+        with self._lock:
+            self._cache[key] = prediction
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return prediction
+
+    def predict_batch(self, matrix):
+        """ predictions for an encoded matrix, out-of-grid rows are scored live """
+
+        offsets = matrix.astype(np.int64) - np.array(self.lows)
+        inside = np.all((offsets >= 0) & (offsets < np.array(self.shape)), axis=1)
+        predictions = np.empty(len(matrix), dtype=np.float64)
+        predictions[inside] = self.values[offsets[inside] @ np.array(self.strides)]
+        if not inside.all():
+            predictions[~inside] = self.booster.inplace_predict(matrix[~inside])
+        self.hits += int(inside.sum())
+        self.misses += int((~inside).sum())
+        return predictions
+
+    def stats(self):
+        """ size and hit/miss counters of the table """
+
+        return {
+            'size': len(self.values),
+            'hits': self.hits,
+            'cache_hits': self.cache_hits,
+            'misses': self.misses,
+            'cache_entries': len(self._cache),
+            'cache_size': self.cache_size,
+        }
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+
+# the modules live at the repo root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def train_booster(columns, scale=100.0, rounds=5):
+    """ a small booster trained on random whole numbers, rent = scale x first column """
+
+    import xgboost as xgb
+
+    rng = np.random.default_rng(0)
+    X = rng.integers(0, 6, size=(200, len(columns))).astype(np.float32)
+    matrix = xgb.DMatrix(X, label=X[:, 0] * scale, feature_names=columns)
+    return xgb.train({'max_depth': 3}, matrix, rounds)
+
+
+@pytest.fixture
+def booster_factory():
+    return train_booster
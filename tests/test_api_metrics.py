@@ -0,0 +1,109 @@
+import math
+import os
+import re
+
+import pytest
+
+os.environ.setdefault('SECRET_KEY', 'test')
+for name in ('METRICS_DIR', 'AUDIT_LOG', 'MICRO_BATCHING', 'PREDICTION_TABLE'):
+    os.environ.pop(name, None)
+
+import api  # noqa: E402
+
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus(text):
+    """ parses the text exposition format strictly, returns {(name, labels): value} """
+
+    types = {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            continue
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            assert kind in ('counter', 'gauge', 'histogram'), line
+            assert name not in types, f'{name} declared twice'
+            types[name] = kind
+            continue
+        match = SAMPLE.match(line)
+        assert match, f'invalid sample line {line!r}'
+        name, _, labels, value = match.groups()
+        family = re.sub(r'_(bucket|sum|count)$', '', name) if name not in types else name
+        assert family in types, f'{name} has no TYPE'
+        labels = tuple(LABEL.findall(labels or ''))
+        assert (name, labels) not in samples, f'duplicate sample {line!r}'
+        samples[(name, labels)] = float(value)
+
+    # cumulative histogram buckets end with +Inf == _count
+    for (name, labels), value in samples.items():
+        if name.endswith('_count') and types.get(name[:-6]) == 'histogram':
+            buckets = [v for (n, l), v in samples.items()
+                       if n == name[:-6] + '_bucket' and tuple(p for p in l if p[0] != 'le') == labels]
+            assert buckets == sorted(buckets) and buckets[-1] == value
+    assert all(not math.isnan(v) for v in samples.values())
+    return samples
+
+
+@pytest.fixture
+def client():
+    api.app.config['WTF_CSRF_ENABLED'] = False
+    return api.app.test_client()
+
+
+def counter(client, name, route):
+    samples = parse_prometheus(client.get('/metrics').get_data(as_text=True))
+    return samples.get((f'houzstack_{name}', (('route', route),)), 0)
+
+
+def test_failed_form_post_counts_as_validation_failure(client):
+    before = counter(client, 'validation_failures_total', 'england_form_predict')
+    response = client.post('/form/v1/england/predict', data={'bedrooms': ''})
+    assert response.status_code == 200
+    assert counter(client, 'validation_failures_total', 'england_form_predict') == before + 1
+    assert counter(client, 'errors_total', 'england_form_predict') == 0
+
+
+def test_prediction_exception_on_form_counts_as_error(client, monkeypatch):
+    def broken(*args):
+        raise RuntimeError('model failed')
+
+    monkeypatch.setattr(api, 'predict_listing', broken)
+    before = counter(client, 'errors_total', 'nigeria_form_predict')
+    response = client.post('/form/v1/nigeria/predict', data={
+        'serviced': 'Yes', 'newly_built': 'No', 'furnished': 'No',
+        'bedrooms': 2, 'bathrooms': 2, 'toilets': 2,
+    })
+    assert response.status_code == 200
+    assert counter(client, 'errors_total', 'nigeria_form_predict') == before + 1
+
+
+def test_batcher_timeout_is_a_503(client, monkeypatch):
+    def slow(*args):
+        raise api.BatchTimeoutError('uk prediction timed out after 5.0s')
+
+    monkeypatch.setattr(api, 'predict_listing', slow)
+    before = counter(client, 'errors_total', 'predict_uk')
+    response = client.post('/api/vi/uk/predict', json={'bedrooms': 2})
+    assert response.status_code == 503
+    assert 'please try again' in response.get_json()['error']
+    assert counter(client, 'errors_total', 'predict_uk') == before + 1
+
+
+def test_json_validation_failure_and_success_are_counted(client):
+    before = counter(client, 'validation_failures_total', 'predict_uk')
+    assert client.post('/api/vi/uk/predict', json={'bedrooms': True}).status_code == 422
+    assert client.post('/api/vi/uk/predict', json={'bedrooms': 2}).status_code == 200
+    assert counter(client, 'validation_failures_total', 'predict_uk') == before + 1
+
+
+def test_metrics_is_valid_prometheus_text(client):
+    client.post('/api/v1/nigeria/predict/batch', json=[{'bedrooms': 1}])
+    response = client.get('/metrics')
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    samples = parse_prometheus(response.get_data(as_text=True))
+    assert any(name == 'houzstack_model_info' for name, _ in samples)
+    assert any(name == 'houzstack_request_seconds_bucket' for name, _ in samples)
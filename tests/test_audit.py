@@ -0,0 +1,137 @@
+import glob
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from audit import AuditLog
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_records_are_written_on_close(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), flush_interval=0.05)
+    for i in range(100):
+        log.record({'i': i})
+    log.close()
+
+    assert [r['i'] for r in read_lines(log.path)] == list(range(100))
+    assert log.stats()['written'] == 100
+    assert log.stats()['dropped'] == 0
+
+
+def test_full_queue_drops_and_counts(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), max_queue=1)
+    # the writer has not been started, so nothing drains the queue
+    log._queue.put_nowait({'i': 0})
+    log._writer.ensure_started = lambda: None
+    log.record({'i': 1})
+    assert log.stats()['dropped'] == 1
+
+
+def test_queue_bytes_bound_drops_and_counts(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), max_queue_bytes=1000)
+    log._writer.ensure_started = lambda: None
+    log.record({'i': 0}, size=600)
+    log.record({'i': 1}, size=600)
+    log.record({'i': 2}, size=400)
+    stats = log.stats()
+    assert stats['dropped'] == 1
+    assert stats['queue_depth'] == 2
+    assert stats['queue_bytes'] == 1000
+
+
+def test_written_records_release_queue_bytes(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), flush_interval=0.05, max_queue_bytes=1000)
+    for i in range(10):
+        log.record({'i': i}, size=100)
+    log.close()
+    assert log.stats()['written'] == 10
+    assert log.stats()['queue_bytes'] == 0
+
+
+def test_ndjson_batch_is_recorded_raw_and_replays(tmp_path, monkeypatch):
+    os.environ.setdefault('SECRET_KEY', 'test')
+    import api
+    import bench
+
+    listing = ('{"serviced": "Yes", "newly_built": "No", "furnished": "No", '
+               '"bedrooms": %d, "bathrooms": 2, "toilets": 2}')
+    body = '\n'.join([listing % 1, 'not json', '', listing % 3, '{"bedrooms": 3}']) + '\n'
+    path = '/api/v1/nigeria/predict/batch'
+    recorded = []
+    for name in ('audit.jsonl', 'replay.jsonl'):
+        log = AuditLog(str(tmp_path / name), flush_interval=0.05)
+        monkeypatch.setattr(api, 'audit_log', log)
+        if not recorded:
+            response = api.app.test_client().post(path, data=body, content_type='application/x-ndjson')
+        else:
+            status = bench.InProcessClient().send(recorded[0])
+        log.close()
+        recorded.append(read_lines(log.path)[0])
+
+    original, replayed = recorded
+    assert response.status_code == status == 200
+    assert original['body'] == body
+    assert original['content_type'] == 'application/x-ndjson'
+    assert 'json' not in original
+    for key in ('body', 'content_type', 'indices', 'predictions'):
+        assert replayed[key] == original[key]
+
+
+def test_rotation_compresses_and_prunes(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    log = AuditLog(path, batch_size=1, flush_interval=0.05, max_bytes=200, backups=2)
+    for i in range(60):
+        log.record({'i': i, 'padding': 'x' * 20})
+    log.close()
+
+    rotated = sorted(glob.glob(path + '.*'))
+    assert log.stats()['rotations'] > 2
+    # only the newest backups are kept, all of them gzipped
+    assert len(rotated) == 2
+    assert all(name.endswith('.gz') for name in rotated)
+
+    kept = [r['i'] for name in rotated for r in read_lines(name)] + [r['i'] for r in read_lines(path)]
+    assert kept == sorted(kept)
+    assert kept[-1] == 59
+
+
+def test_queued_records_are_written_at_exit(tmp_path):
+    path = tmp_path / 'audit.jsonl'
+    script = (
+        'from audit import AuditLog\n'
+        f'log = AuditLog({str(path)!r}, flush_interval=60)\n'
+        'for i in range(500):\n'
+        '    log.record({"i": i})\n'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', script], cwd=root, check=True, timeout=30)
+    assert len(read_lines(str(path))) == 500
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_processes_write_their_own_file(tmp_path):
+    path = str(tmp_path / 'audit.jsonl')
+    log = AuditLog(path, flush_interval=0.05)
+
+    pid = os.fork()
+    if pid == 0:
+        # the child must not return into pytest
+        try:
+            for i in range(50):
+                log.record({'i': i})
+            log.close()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert not os.path.exists(path)
+    assert len(read_lines(str(tmp_path / f'audit.{pid}.jsonl'))) == 50
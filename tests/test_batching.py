@@ -0,0 +1,94 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import BatchTimeoutError, MicroBatcher, QueueFullError
+
+
+def row(value):
+    return np.array([value], dtype=np.float32)
+
+
+def test_concurrent_rows_are_flushed_together():
+    batches = []
+
+    def predict(matrix):
+        batches.append(len(matrix))
+        return matrix[:, 0] * 2
+
+    batcher = MicroBatcher('test', predict, max_batch_size=4, max_wait=0.2)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.submit(row(i))))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == {i: 2.0 * i for i in range(8)}
+    # full batches are flushed without waiting for max_wait
+    assert max(batches) == 4
+    assert batcher.stats()['rows'] == 8
+
+
+def test_a_lone_row_is_flushed_after_max_wait():
+    batcher = MicroBatcher('test', lambda matrix: matrix[:, 0], max_batch_size=64, max_wait=0.05)
+    start = time.monotonic()
+    assert batcher.submit(row(7)) == 7.0
+    assert time.monotonic() - start < 2
+    assert batcher.stats()['batches'] == 1
+
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+
+    def predict(matrix):
+        release.wait(5)
+        return matrix[:, 0]
+
+    batcher = MicroBatcher('test', predict, max_batch_size=1, max_wait=0, max_queue=1)
+    # the first row is taken by the scheduler and blocks in predict, the second fills the queue
+    first = threading.Thread(target=batcher.submit, args=(row(1),))
+    first.start()
+    while batcher.stats()['batches'] == 0:
+        time.sleep(0.01)
+    second = threading.Thread(target=batcher.submit, args=(row(2),))
+    second.start()
+    while batcher.stats()['queue_depth'] == 0:
+        time.sleep(0.01)
+
+    with pytest.raises(QueueFullError):
+        batcher.submit(row(3))
+    assert batcher.stats()['rejected'] == 1
+
+    release.set()
+    first.join(5)
+    second.join(5)
+
+
+def test_predict_errors_reach_every_caller():
+    def predict(matrix):
+        raise RuntimeError('model failed')
+
+    batcher = MicroBatcher('test', predict, max_wait=0)
+    with pytest.raises(RuntimeError, match='model failed'):
+        batcher.submit(row(1))
+
+
+def test_slow_prediction_times_out_and_scheduler_keeps_running():
+    release = threading.Event()
+
+    def predict(matrix):
+        release.wait(5)
+        return matrix[:, 0]
+
+    batcher = MicroBatcher('test', predict, max_wait=0, timeout=0.05)
+    with pytest.raises(BatchTimeoutError):
+        batcher.submit(row(1))
+    assert batcher.stats()['timeouts'] == 1
+
+    # the abandoned row still gets its result set without killing the scheduler
+    release.set()
+    assert batcher.submit(row(2), timeout=5) == 2.0
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from features import (
+    NIGERIA_SCHEMA, UK_SCHEMA, Feature, InvalidFieldError, MissingFieldError, parse_listings,
+)
+
+
+VALUES = [
+    1, 0, -1, 2.5, '1', ' 2 ', '2.0', '2.5', '1e2', '1_000', '٣', '-3', '0x10', 'abc', 'yes', 'YES', 'No',
+    True, False, np.bool_(True), 'true', 'Infinity', '-inf', float('inf'), float('nan'), 'nan',
+    10 ** 400, '10' * 200, [1], {'rooms': 1}, None, '', np.int64(3),
+]
+
+
+def encode_single(feature, value):
+    try:
+        return feature.encode(value)
+    except MissingFieldError:
+        return 'missing'
+    except InvalidFieldError:
+        return 'invalid'
+
+
+@pytest.mark.parametrize('kind', Feature.KINDS)
+def test_batch_encoder_matches_single_encoder(kind):
+    import pandas as pd
+
+    feature = Feature('Rooms', 'rooms', kind)
+    values, missing, invalid = feature.encode_column(pd.Series(VALUES, dtype=object))
+    for i, value in enumerate(VALUES):
+        expected = encode_single(feature, value)
+        batch = ('missing' if missing[i] else 'invalid') if invalid[i] else float(values[i])
+        assert batch == expected, f'{value!r}'
+
+
+def test_batch_rows_match_single_rows():
+    base = {'serviced': 'Yes', 'newly_built': 'no', 'furnished': 'YES',
+            'bedrooms': 3, 'bathrooms': '2', 'toilets': 4}
+    listings = [dict(base, bedrooms=value) for value in VALUES] + [dict(base), 'not an object']
+
+    matrix, indices, errors = NIGERIA_SCHEMA.encode_batch(listings)
+    rows = dict(zip(indices, matrix.tolist()))
+    messages = {error['index']: error['error'] for error in errors}
+    assert set(rows) | set(messages) == set(range(len(listings)))
+    for i, listing in enumerate(listings):
+        try:
+            single = NIGERIA_SCHEMA.encode(listing)[0].tolist()
+        except (AttributeError, ValueError) as e:
+            assert i in messages and i not in rows
+            if isinstance(e, ValueError):
+                assert messages[i] == str(e)
+        else:
+            assert rows[i] == single
+
+
+def test_parse_listings_reports_bad_ndjson_lines():
+    body = b'{"bedrooms": 2}\n{"bedrooms": \n\n[1]\n{"bedrooms": 4}\n'
+    listings, rejected = parse_listings(body, 'application/x-ndjson')
+    assert len(listings) == 4 and list(rejected) == [1]
+
+    matrix, indices, errors = UK_SCHEMA.encode_batch(listings, rejected)
+    assert indices == [0, 3]
+    assert matrix[:, 0].tolist() == [2, 4]
+    assert [e['index'] for e in errors] == [1, 2]
+    assert errors[0]['error'].startswith('line is not valid json')
+
+
+def test_parse_listings_rejects_a_broken_array():
+    with pytest.raises(ValueError):
+        parse_listings(b'[{"bedrooms": 2}', 'application/json')
+    with pytest.raises(ValueError):
+        parse_listings(b'{"bedrooms": 2}', 'application/json')
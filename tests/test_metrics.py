@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+from metrics import Metrics
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_shared_metrics_sum_counters_across_workers(tmp_path):
+    # a worker that has exited since it wrote its snapshot
+    other = Metrics()
+    other.share(str(tmp_path))
+    other.inc('requests_total', (('route', 'predict_uk'), ('status', '200')), 3)
+    other.observe('request_seconds', (('route', 'predict_uk'),), 0.002)
+    other.write_snapshot([('table_lookups_total', 'counter', 'lookups', [((('result', 'hit'),), 4)]),
+                          ('batcher_queue_depth', 'gauge', 'depth', [((), 7)])])
+    os.replace(tmp_path / f'{os.getpid()}.json', tmp_path / f'{dead_pid()}.json')
+
+    metrics = Metrics()
+    metrics.share(str(tmp_path))
+    metrics.inc('requests_total', (('route', 'predict_uk'), ('status', '200')), 2)
+    metrics.observe('request_seconds', (('route', 'predict_uk'),), 0.002)
+    text = metrics.render([('table_lookups_total', 'counter', 'lookups', [((('result', 'hit'),), 1)]),
+                           ('batcher_queue_depth', 'gauge', 'depth', [((), 2)])])
+
+    assert 'houzstack_requests_total{route="predict_uk",status="200"} 5' in text
+    assert 'houzstack_request_seconds_count{route="predict_uk"} 2' in text
+    assert 'houzstack_table_lookups_total{result="hit"} 5' in text
+    # gauges are per live worker
+    assert f'houzstack_batcher_queue_depth{{worker="{os.getpid()}"}} 2' in text
+    assert 'houzstack_batcher_queue_depth{worker=' in text and ' 7\n' not in text
+
+
+def test_unshared_metrics_render_the_process_only():
+    metrics = Metrics()
+    metrics.inc('errors_total', (('route', 'predict_uk'),))
+    assert 'houzstack_errors_total{route="predict_uk"} 1' in metrics.render()
@@ -0,0 +1,105 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from features import UK_SCHEMA
+from registry import ModelRegistry, file_checksum, load_booster, metadata_path
+
+
+def save(booster, path, mtime):
+    """ replaces the artifact atomically and gives it a distinct mtime """
+
+    staged = os.path.join(os.path.dirname(path), '.staged.ubj')
+    booster.save_model(staged)
+    os.utime(staged, (mtime, mtime))
+    os.replace(staged, path)
+
+
+def predict(entry, rooms=3):
+    return float(entry.booster.inplace_predict(np.array([[rooms]], dtype=np.float32))[0])
+
+
+@pytest.fixture
+def artifact(tmp_path, booster_factory):
+    path = str(tmp_path / 'uk.ubj')
+    save(booster_factory(UK_SCHEMA.columns, scale=100), path, 1_000_000)
+    return path
+
+
+@pytest.fixture
+def registry(artifact):
+    registry = ModelRegistry(check_interval=0)
+    registry.register('uk', artifact, load_booster)
+    registry.add_listener(lambda entry: UK_SCHEMA.check(entry.booster))
+    registry.load_all()
+    return registry
+
+
+def test_changed_artifact_is_swapped_in(registry, artifact, booster_factory):
+    old = registry.get('uk')
+    save(booster_factory(UK_SCHEMA.columns, scale=1000), artifact, 2_000_000)
+
+    new = registry.get('uk')
+    assert new is not old
+    assert new.checksum == file_checksum(artifact)
+    assert new.version == new.checksum[:12]
+    assert predict(new) > 5 * predict(old)
+    # the old snapshot keeps working for requests that still hold it
+    assert predict(old) == pytest.approx(300, rel=0.5)
+
+
+def test_touched_but_identical_artifact_keeps_the_entry(registry, artifact):
+    entry = registry.get('uk')
+    os.utime(artifact, (3_000_000, 3_000_000))
+    assert registry.get('uk') is entry
+    assert entry.mtime == 3_000_000
+
+
+def test_corrupt_artifact_keeps_the_loaded_version(registry, artifact):
+    entry = registry.get('uk')
+    with open(artifact, 'wb') as f:
+        f.write(b'half written')
+    assert registry.get('uk') is entry
+    assert predict(registry.get('uk')) == predict(entry)
+
+
+def test_rejected_artifact_keeps_the_loaded_version(registry, artifact, booster_factory):
+    entry = registry.get('uk')
+    save(booster_factory(['Bedrooms']), artifact, 2_000_000)
+    # the schema listener refuses a model trained on other columns
+    assert registry.get('uk') is entry
+
+
+def test_first_load_failure_is_raised(tmp_path):
+    path = tmp_path / 'broken.ubj'
+    path.write_bytes(b'not a model')
+    registry = ModelRegistry()
+    registry.register('uk', str(path), load_booster)
+    with pytest.raises(Exception):
+        registry.load_all()
+
+
+def test_missing_artifact_keeps_the_loaded_version(registry, artifact):
+    entry = registry.get('uk')
+    os.remove(artifact)
+    assert registry.get('uk') is entry
+
+
+def test_version_comes_from_a_matching_sidecar_only(registry, artifact, booster_factory):
+    with open(metadata_path(artifact), 'w') as f:
+        json.dump({'version': '2024.09', 'checksum': file_checksum(artifact)}, f)
+    os.utime(artifact, (2_000_000, 2_000_000))
+    # only the mtime changed, so the entry is not reloaded
+    assert registry.get('uk').version != '2024.09'
+
+    registry = ModelRegistry(check_interval=0)
+    registry.register('uk', artifact, load_booster)
+    assert registry.get('uk').version == '2024.09'
+
+    # a retrained model next to the stale sidecar reports its own checksum
+    save(booster_factory(UK_SCHEMA.columns, scale=1000), artifact, 3_000_000)
+    entry = registry.get('uk')
+    assert entry.version == entry.checksum[:12]
+    assert entry.metadata == {}
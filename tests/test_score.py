@@ -0,0 +1,69 @@
+import json
+
+import score
+
+
+def write_listings(path, n):
+    with open(path, 'w') as f:
+        for i in range(n):
+            listing = {'bedrooms': i % 6} if i % 7 else {'bedrooms': 'many'}
+            f.write(json.dumps(listing) + '\n')
+
+
+def run(listings, output, *args):
+    score.main(['uk', str(listings), str(output), '--chunksize', '10', '--workers', '1', *args])
+
+
+def test_resume_truncates_the_unfinished_chunk(tmp_path):
+    listings = tmp_path / 'listings.jsonl'
+    write_listings(listings, 45)
+    run(listings, tmp_path / 'expected.jsonl')
+    expected = (tmp_path / 'expected.jsonl').read_bytes()
+    assert len(expected.splitlines()) == 45
+
+    # a run killed while writing its third chunk: two chunks checkpointed,
+    # then part of the next one written after the checkpoint
+    output = tmp_path / 'scored.jsonl'
+    done = b''.join(expected.splitlines(keepends=True)[:20])
+    output.write_bytes(done + b'{"bedrooms": 1, "ren')
+    checkpoint = score.Checkpoint(str(output))
+    checkpoint.save({'input': str(listings.resolve()), 'model': 'uk', 'chunksize': 10,
+                     'chunks': 2, 'rows': 20, 'output_bytes': len(done)})
+
+    run(listings, output, '--resume')
+    assert output.read_bytes() == expected
+    assert checkpoint.load() is None
+
+
+def test_without_resume_the_output_is_replaced(tmp_path):
+    listings = tmp_path / 'listings.jsonl'
+    write_listings(listings, 12)
+    output = tmp_path / 'scored.jsonl'
+    output.write_text('stale\n')
+
+    run(listings, output)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(lines) == 12
+    assert lines[0]['error'] == 'bedrooms field must be a positive number'
+    assert lines[1]['rent'] is not None
+
+
+def test_csv_resume_counts_rows_not_lines(tmp_path):
+    listings = tmp_path / 'listings.csv'
+    listings.write_text('bedrooms\n1\n2\n\n3\n4\n')
+
+    assert [r['bedrooms'] for chunk in score.read_chunks(str(listings), 'csv', 2, 3) for r in chunk] == ['4']
+
+    run(listings, tmp_path / 'expected.csv')
+    expected = (tmp_path / 'expected.csv').read_bytes()
+    assert len(expected.splitlines()) == 5
+
+    # killed after the header and three scored rows, the blank line comes before the resume point
+    output = tmp_path / 'scored.csv'
+    done = b''.join(expected.splitlines(keepends=True)[:4])
+    output.write_bytes(done + b'4,')
+    score.Checkpoint(str(output)).save({'input': str(listings.resolve()), 'model': 'uk', 'chunksize': 2,
+                                        'chunks': 2, 'rows': 3, 'output_bytes': len(done)})
+
+    run(listings, output, '--resume')
+    assert output.read_bytes() == expected
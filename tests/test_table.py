@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from features import NIGERIA_SCHEMA, UK_SCHEMA
+from registry import ModelRegistry, load_booster
+from table import PredictionTable
+
+
+@pytest.fixture
+def nigeria_table(booster_factory):
+    return PredictionTable(NIGERIA_SCHEMA, booster_factory(NIGERIA_SCHEMA.columns), cache_size=2)
+
+
+def test_index_inside_and_outside_the_grid(nigeria_table):
+    # flags 0..1, counts 0..10, the last column varies fastest
+    assert nigeria_table.index([0, 0, 0, 0, 0, 0]) == 0
+    assert nigeria_table.index([0, 0, 0, 0, 0, 1]) == 1
+    assert nigeria_table.index([0, 0, 0, 0, 1, 0]) == 11
+    assert nigeria_table.index([1, 1, 1, 10, 10, 10]) == len(nigeria_table) - 1
+    assert nigeria_table.index([0, 0, 0, 11, 0, 0]) is None
+    assert nigeria_table.index([0, 0, 0, -1, 0, 0]) is None
+    assert len(nigeria_table) == 2 * 2 * 2 * 11 * 11 * 11
+
+
+def test_out_of_grid_rows_go_through_the_lru_cache(nigeria_table):
+    rows = [[0, 0, 0, 11 + i, 0, 0] for i in range(3)]
+    first = nigeria_table.predict(rows[0])
+    assert nigeria_table.predict(rows[0]) == first
+    assert nigeria_table.stats()['cache_hits'] == 1
+
+    nigeria_table.predict(rows[1])
+    nigeria_table.predict(rows[2])
+    # cache_size is 2, so the least recently used row was evicted
+    assert nigeria_table.stats()['cache_entries'] == 2
+    nigeria_table.predict(rows[0])
+    assert nigeria_table.stats()['misses'] == 4
+
+    nigeria_table.predict([0, 0, 0, 1, 1, 1])
+    assert nigeria_table.stats()['hits'] == 1
+
+
+def test_predictions_match_the_booster(nigeria_table):
+    rng = np.random.default_rng(1)
+    matrix = rng.integers(0, 14, size=(200, 6)).astype(np.float32)
+    matrix[:, :3] = matrix[:, :3] % 2
+    expected = nigeria_table.booster.inplace_predict(matrix)
+
+    assert np.allclose(nigeria_table.predict_batch(matrix), expected, rtol=1e-6)
+    assert np.allclose([nigeria_table.predict(row) for row in matrix], expected, rtol=1e-6)
+    stats = nigeria_table.stats()
+    assert stats['hits'] > 0 and stats['misses'] > 0
+
+
+def test_table_is_rebuilt_when_the_model_changes(tmp_path, booster_factory):
+    path = str(tmp_path / 'uk.ubj')
+    booster_factory(UK_SCHEMA.columns, scale=100).save_model(path)
+
+    registry = ModelRegistry(check_interval=0)
+    registry.register('uk', path, load_booster)
+    registry.add_listener(lambda entry: setattr(entry, 'table', PredictionTable(UK_SCHEMA, entry.booster)))
+    old = registry.get('uk')
+
+    booster_factory(UK_SCHEMA.columns, scale=1000).save_model(path + '.tmp.ubj')
+    os.utime(path + '.tmp.ubj', (2_000_000, 2_000_000))
+    os.replace(path + '.tmp.ubj', path)
+    new = registry.get('uk')
+
+    assert new is not old and new.table is not old.table
+    row = np.array([[3]], dtype=np.float32)
+    assert new.table.predict(row[0]) == pytest.approx(float(new.booster.inplace_predict(row)[0]))
+    assert new.table.predict(row[0]) > 5 * old.table.predict(row[0])
@@ -0,0 +1,225 @@
+""" training pipeline for the rent models, replacing the notebook cleaning code
+
+the csv is streamed in chunks with explicit dtypes, cleaned with vectorized
+string operations and deduplicated incrementally by row hash, so only the
+cleaned numeric columns are ever held in memory. the model is trained with
+the hist tree method and written as a versioned native booster that the api
+loads (see export_models.py):
+
+    python train.py nigeria datasets/nigeria-rent.csv --nthread 8
+    python train.py uk datasets/uk_housing_rentals.csv --version 2024.09 --no-promote
+"""
+
+import argparse
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from export_models import write_metadata
+from features import SCHEMAS
+from registry import BASE_DIR, metadata_path
+
+
+def leading_number(text):
+    """ first whitespace separated token of each value as a number, '3 beds' -> 3 """
+
+    return pd.to_numeric(text.str.strip().str.split(n=1).str[0], errors='coerce')
+
+
+def digits(text):
+    """ every digit of each value as a number, '£1,250 pcm' -> 1250 """
+
+    return pd.to_numeric(text.str.replace(r'\D', '', regex=True), errors='coerce')
+
+
+def clean_nigeria(chunk):
+    """ cleans one chunk of the nigeria-rent.csv listing dump """
+
+    df = pd.DataFrame({
+        'Serviced': chunk['Serviced'],
+        'Newly Built': chunk['Newly Built'],
+        'Furnished': chunk['Furnished'],
+        'Bedrooms': leading_number(chunk['Bedrooms']),
+        'Bathrooms': leading_number(chunk['Bathrooms']),
+        'Toilets': leading_number(chunk['Toilets']),
+        # '1,500,000/year' -> 1500000
+        'Price': digits(chunk['Price'].str.split('/', n=1).str[0]),
+    }).dropna()
+    return df[df['Price'] < 1_000_000_000]
+
+
+def clean_uk(chunk):
+    """ cleans one chunk of the uk_housing_rentals.csv listing dump """
+
+    return pd.DataFrame({
+        # 'Not specified' rooms become NaN and are dropped
+        'Number of Rooms': leading_number(chunk['Number of Rooms']),
+        'Price': digits(chunk['Price']),
+    }).dropna()
+
+
+# raw columns and dtypes read from each csv, the cleaner for its chunks and
+# the columns that identify a duplicate listing
+DATASETS = {
+    'nigeria': {
+        'dtypes': {
+            'Title': 'string', 'More Info': 'string', 'Location': 'string', 'Price': 'string',
+            'Serviced': 'float32', 'Newly Built': 'float32', 'Furnished': 'float32',
+            'Bedrooms': 'string', 'Bathrooms': 'string', 'Toilets': 'string',
+        },
+        'clean': clean_nigeria,
+    },
+    'uk': {
+        # the unnamed index column is skipped, it would make every row unique
+        'dtypes': {
+            'Description': 'string', 'Location': 'string',
+            'Number of Rooms': 'string', 'Price': 'string',
+        },
+        'clean': clean_uk,
+    },
+}
+
+
+class Timer:
+    """ accumulates wall time per pipeline stage """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def run(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.add(stage, time.perf_counter() - start)
+        return result
+
+
+def load_dataset(name, path, chunksize, timer):
+    """ streams, deduplicates and cleans a csv, returns the cleaned frame and row counts """
+
+    spec = DATASETS[name]
+    seen = set()
+    cleaned = []
+    counts = {'read': 0, 'duplicates': 0, 'kept': 0}
+
+    reader = pd.read_csv(path, usecols=list(spec['dtypes']), dtype=spec['dtypes'], chunksize=chunksize)
+    while True:
+        start = time.perf_counter()
+        chunk = next(reader, None)
+        timer.add('read', time.perf_counter() - start)
+        if chunk is None:
+            break
+        counts['read'] += len(chunk)
+
+        start = time.perf_counter()
+        # incremental deduplication on the raw row, like drop_duplicates in the notebooks
+        chunk = chunk.dropna()
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        _, first = np.unique(hashes, return_index=True)
+        first.sort()
+        fresh = np.array([hashes[i] not in seen for i in first], dtype=bool)
+        keep = first[fresh]
+        seen.update(hashes[keep].tolist())
+        counts['duplicates'] += len(chunk) - len(keep)
+        chunk = chunk.iloc[keep]
+        timer.add('dedupe', time.perf_counter() - start)
+
+        df = timer.run('clean', spec['clean'], chunk)
+        cleaned.append(df.astype({c: 'int64' for c in df.columns}))
+
+    columns = SCHEMAS[name].columns + ['Price']
+    df = pd.concat(cleaned, ignore_index=True) if cleaned else pd.DataFrame(columns=columns, dtype='int64')
+    counts['kept'] = len(df)
+    return df[columns], counts
+
+
+def train(df, name, nthread, test_size, seed, timer, **params):
+    """ fits an XGBRegressor with the hist tree method, returns the model and test MAE """
+
+    import xgboost as xgb
+    from sklearn.metrics import mean_absolute_error
+    from sklearn.model_selection import train_test_split
+
+    X = df[SCHEMAS[name].columns]
+    Y = df['Price']
+    X_train, X_test, Y_train, Y_test = timer.run(
+        'split', train_test_split, X, Y, test_size=test_size, random_state=seed)
+
+    model = xgb.XGBRegressor(tree_method='hist', n_jobs=nthread, random_state=seed, **params)
+    timer.run('fit', model.fit, X_train, Y_train)
+    prediction = timer.run('evaluate', model.predict, X_test)
+    return model, float(mean_absolute_error(Y_test, prediction))
+
+
+def save(model, name, output_dir, version, promote, **extra):
+    """ writes models/<name>-<version>.ubj and, when promoting, replaces models/<name>.ubj
+
+    the served file is swapped with os.replace so the running api's registry
+    never sees a half-written artifact
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    booster = model.get_booster()
+    path = os.path.join(output_dir, f'{name}-{version}.ubj')
+    booster.save_model(path)
+    metadata = write_metadata(path, name, booster, version=version, **extra)
+
+    if promote:
+        served = os.path.join(output_dir, f'{name}.ubj')
+        # the sidecar goes first, the registry reads it when the model changes
+        for source, target in ((metadata_path(path), metadata_path(served)), (path, served)):
+            shutil.copyfile(source, target + '.tmp')
+            os.replace(target + '.tmp', target)
+    return path, metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='train a rent model from a csv listing dump')
+    parser.add_argument('model', choices=list(DATASETS))
+    parser.add_argument('csv', help='path of the raw listing csv')
+    parser.add_argument('--chunksize', type=int, default=100_000, help='rows read per chunk')
+    parser.add_argument('--nthread', type=int, default=os.cpu_count(), help='xgboost training threads')
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--max-depth', type=int, default=6)
+    parser.add_argument('--learning-rate', type=float, default=0.3)
+    parser.add_argument('--output-dir', default=os.path.join(BASE_DIR, 'models'))
+    parser.add_argument('--version', help='artifact version, defaults to the current UTC time')
+    parser.add_argument('--no-promote', action='store_true',
+                        help='only write the versioned artifact, do not replace the served model')
+    args = parser.parse_args(argv)
+
+    version = args.version or datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
+    timer = Timer()
+    start = time.perf_counter()
+
+    df, counts = load_dataset(args.model, args.csv, args.chunksize, timer)
+    if len(df) < 2:
+        parser.error(f'only {len(df)} usable rows in {args.csv}')
+
+    model, mae = train(df, args.model, args.nthread, args.test_size, args.seed, timer,
+                       n_estimators=args.n_estimators, max_depth=args.max_depth,
+                       learning_rate=args.learning_rate)
+
+    timings = {stage: round(seconds, 4) for stage, seconds in timer.stages.items()}
+    path, _ = timer.run('save', save, model, args.model, args.output_dir, version, not args.no_promote,
+                        training_mae=mae, rows=counts, timings=timings, nthread=args.nthread,
+                        source=os.path.basename(args.csv))
+    timer.add('total', time.perf_counter() - start)
+
+    print(f'rows read {counts["read"]}, duplicates {counts["duplicates"]}, kept {counts["kept"]}')
+    print(f'test MAE {mae:,.2f}')
+    for stage, seconds in timer.stages.items():
+        print(f'{stage:<10}{seconds:>10.3f}s')
+    print(f'wrote {os.path.relpath(path)}' + ('' if args.no_promote else ' and promoted it'))
+
+
+if __name__ == '__main__':
+    main()